@@ -0,0 +1,364 @@
+"""Headless HTTP API for letter generation.
+
+Usage:
+    python api_server.py --port 8080 --workers 4
+
+Endpoints:
+    GET  /health          liveness check
+    GET  /metrics         Prometheus text, or JSON with ?format=json
+    POST /letters         {"letter_type", "style", "locale", "date", "format": "text"|"pdf", "data": {...}}
+    POST /letters:batch   {"format": "text"|"pdf"|"zip",
+                           "letters": [{"letter_type", "style", "locale", "date", "data": {...}}, ...]}
+
+Field names and required fields are the ones in LETTER_FIELDS, with dates in
+ISO format. "date" is the date printed on the letter and defaults to today;
+"locale" is one of LETTER_LOCALES and defaults to DEFAULT_LOCALE. Letters of
+different locales can be mixed in one batch. A batch is rendered only if every letter in it is valid; otherwise
+the response is 422 with the errors of each invalid letter. Connections are
+kept alive, and PDF and batch rendering run on a process pool so the event
+loop keeps serving other requests.
+
+Each client address is rate limited per letter by RateLimiter, configured
+with the same RATE_LIMIT_<OPERATION> variables as the app: "generate" for
+every letter and also "pdf" for PDF and ZIP output, so a batch costs as
+many tokens as it has letters. Letters are validated first, so a 422
+response costs no tokens. Requests over the limit get 429 with the
+seconds to wait in details.retry_after; a batch larger than the burst of
+either limit could never be admitted and gets 413.
+"""
+import argparse
+import asyncio
+import io
+import json
+import logging
+import multiprocessing
+import os
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date
+from http import HTTPStatus
+
+import metrics
+from letter_core import (DEFAULT_LOCALE, LETTER_FIELDS, LETTER_LOCALES, LETTER_STYLES, RENDER_CACHE, LetterTemplates,
+                         PDFGenerator, validate_letter_data)
+from rate_limit import RateLimited, RateLimiter
+
+MAX_BODY_BYTES = 16 * 1024 * 1024
+KEEP_ALIVE_TIMEOUT = 15
+SINGLE_FORMATS = {"text", "pdf"}
+BATCH_FORMATS = {"text", "pdf", "zip"}
+
+logger = logging.getLogger(__name__)
+
+
+class APIError(Exception):
+    """Error returned to the client as a JSON body with the given status"""
+
+    def __init__(self, status, message, details=None):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+        self.details = details
+
+
+def render_pdf(letter):
+    """Worker process entry point for a single PDF"""
+    return PDFGenerator().create_pdf(letter)
+
+
+def render_batch(output_format, letters):
+    """Worker process entry point for a validated batch of (letter_type, style, letter_data, render_date, locale)"""
+    texts = [LetterTemplates.render(*letter) for letter in letters]
+    if output_format == "text":
+        return texts
+    buffer = io.BytesIO()
+    if output_format == "zip":
+        PDFGenerator().write_zip(texts, buffer)
+    else:
+        PDFGenerator().write_combined_pdf(texts, buffer)
+    return buffer.getvalue()
+
+
+def parse_letter(payload):
+    """Validate one {"letter_type", "style", "locale", "date", "data"} object.
+
+    Returns ((letter_type, style, letter_data, render_date, locale), errors).
+    """
+    if not isinstance(payload, dict):
+        return None, ["letter must be a JSON object"]
+    letter_type = payload.get("letter_type")
+    style = payload.get("style", "standard")
+    data = payload.get("data")
+    if letter_type not in LETTER_FIELDS:
+        return None, [f"unknown letter_type {letter_type!r}, expected one of {list(LETTER_FIELDS)}"]
+    if style not in LETTER_STYLES:
+        return None, [f"unknown style {style!r}, expected one of {LETTER_STYLES}"]
+    locale = payload.get("locale", DEFAULT_LOCALE)
+    if locale not in LETTER_LOCALES:
+        return None, [f"unknown locale {locale!r}, expected one of {LETTER_LOCALES}"]
+    if not isinstance(data, dict):
+        return None, ["data must be a JSON object"]
+    try:
+        render_date = date.fromisoformat(payload["date"]) if payload.get("date") else date.today()
+    except (TypeError, ValueError):
+        return None, [f"date must be an ISO date (YYYY-MM-DD), got {payload['date']!r}"]
+    letter_data, errors = validate_letter_data(letter_type, data)
+    return (letter_type, style, letter_data, render_date, locale), errors
+
+
+class LetterAPIServer:
+    def __init__(self, host="127.0.0.1", port=8080, workers=None):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count() or 1
+        self.pool = None
+        self.server = None
+        self.limiter = RateLimiter.from_env()
+
+    async def start(self):
+        """Start listening; with port 0 the chosen port is stored in self.port"""
+        # Forked workers would inherit the listening socket and open client connections, so a client
+        # reading until the server closes its connection would wait for the workers to exit instead
+        context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+        self.pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        metrics.REGISTRY.register_gauges("render_cache", RENDER_CACHE.stats)
+        metrics.REGISTRY.register_gauges("rate_limit", self.limiter.stats)
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        """Stop accepting connections and shut down the worker pool"""
+        self.server.close()
+        await self.server.wait_closed()
+        self.pool.shutdown()
+
+    async def serve_forever(self):
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        """Serve requests on one connection until the client closes it or asks to"""
+        peer = writer.get_extra_info("peername")
+        client = peer[0] if isinstance(peer, tuple) else str(peer)
+        try:
+            while True:
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), KEEP_ALIVE_TIMEOUT)
+                except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    await self.send(writer, HTTPStatus.REQUEST_HEADER_FIELDS_TOO_LARGE,
+                                    *self.error_body("Request headers too large"), keep_alive=False)
+                    break
+                method, path, version, headers = self.parse_head(head)
+                keep_alive = self.wants_keep_alive(version, headers)
+                body = None
+                try:
+                    body = await self.read_body(reader, headers)
+                    status, content_type, payload = await self.dispatch(method, path, body, client)
+                except APIError as e:
+                    status, (content_type, payload) = e.status, self.error_body(e.message, e.details)
+                    if body is None:
+                        keep_alive = False  # the unread body makes the rest of the stream unusable
+                except Exception:
+                    logger.exception("Error serving %s %s", method, path)
+                    status, (content_type, payload) = HTTPStatus.INTERNAL_SERVER_ERROR, self.error_body(
+                        "Internal server error")
+                    keep_alive = False
+                await self.send(writer, status, content_type, payload, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def parse_head(head):
+        """Split the request line and headers; header names are lower-cased"""
+        lines = head.decode("latin1").split("\r\n")
+        try:
+            method, path, version = lines[0].split(" ", 2)
+        except ValueError:
+            method, path, version = "", "", "HTTP/1.0"
+        headers = {}
+        for line in lines[1:]:
+            name, sep, value = line.partition(":")
+            if sep:
+                headers[name.strip().lower()] = value.strip()
+        return method, path, version, headers
+
+    @staticmethod
+    def wants_keep_alive(version, headers):
+        connection = headers.get("connection", "").lower()
+        if version == "HTTP/1.1":
+            return connection != "close"
+        return connection == "keep-alive"
+
+    @staticmethod
+    async def read_body(reader, headers):
+        if "chunked" in headers.get("transfer-encoding", "").lower():
+            raise APIError(HTTPStatus.LENGTH_REQUIRED, "Chunked request bodies are not supported")
+        try:
+            length = int(headers.get("content-length", "0"))
+        except ValueError:
+            raise APIError(HTTPStatus.BAD_REQUEST, "Invalid Content-Length")
+        if length > MAX_BODY_BYTES:
+            raise APIError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Body exceeds {MAX_BODY_BYTES} bytes")
+        return await reader.readexactly(length) if length else b""
+
+    async def dispatch(self, method, path, body, client=None):
+        """Route a request from the client address, returning (status, content type, payload bytes)"""
+        path, _, query = path.partition("?")
+        routes = {
+            "/health": ("GET", lambda body, client: self.health(body)),
+            "/metrics": ("GET", lambda body, client: self.metrics(query)),
+            "/letters": ("POST", self.create_letter),
+            "/letters:batch": ("POST", self.create_batch),
+        }
+        if path not in routes:
+            raise APIError(HTTPStatus.NOT_FOUND, f"No route for {path}")
+        expected_method, handler = routes[path]
+        if method != expected_method:
+            raise APIError(HTTPStatus.METHOD_NOT_ALLOWED, f"{path} only accepts {expected_method}")
+        with metrics.phase("api" + path.replace("/", ".")):
+            return await handler(body, client)
+
+    async def health(self, body):
+        return HTTPStatus.OK, "application/json", b'{"status": "ok"}'
+
+    async def metrics(self, query):
+        if "format=json" in query:
+            return HTTPStatus.OK, "application/json", json.dumps(metrics.REGISTRY.snapshot()).encode("utf-8")
+        return HTTPStatus.OK, "text/plain; version=0.0.4", metrics.REGISTRY.to_prometheus().encode("utf-8")
+
+    async def create_letter(self, body, client=None):
+        payload = self.parse_json(body)
+        output_format = self.output_format(payload, SINGLE_FORMATS)
+        letter, errors = parse_letter(payload)
+        if errors:
+            raise APIError(HTTPStatus.UNPROCESSABLE_ENTITY, "Invalid letter", errors)
+        self.admit(client, output_format)
+        letter = LetterTemplates.render(*letter)
+        if output_format == "text":
+            return HTTPStatus.OK, "text/plain; charset=utf-8", letter.encode("utf-8")
+        pdf_bytes = await self.run_in_pool(render_pdf, letter)
+        return HTTPStatus.OK, "application/pdf", pdf_bytes
+
+    async def create_batch(self, body, client=None):
+        payload = self.parse_json(body)
+        output_format = self.output_format(payload, BATCH_FORMATS)
+        items = payload.get("letters")
+        if not isinstance(items, list):
+            raise APIError(HTTPStatus.BAD_REQUEST, "letters must be a JSON array")
+        letters = []
+        invalid = []
+        for index, item in enumerate(items):
+            letter, errors = parse_letter(item)
+            if errors:
+                invalid.append({"index": index, "errors": errors})
+            else:
+                letters.append(letter)
+        if invalid:
+            raise APIError(HTTPStatus.UNPROCESSABLE_ENTITY, "Invalid letters in batch", invalid)
+        self.admit(client, output_format, max(1, len(items)))
+        result = await self.run_in_pool(render_batch, output_format, letters)
+        if output_format == "text":
+            return HTTPStatus.OK, "application/json", json.dumps({"letters": result}).encode("utf-8")
+        if output_format == "zip":
+            return HTTPStatus.OK, "application/zip", result
+        return HTTPStatus.OK, "application/pdf", result
+
+    def admit(self, client, output_format, letters=1):
+        """Charge the letters to the client's generate limit, and to its pdf limit for PDF output"""
+        operations = ["generate"] if output_format == "text" else ["generate", "pdf"]
+        for operation in operations:
+            max_cost = self.limiter.max_cost(operation)
+            if max_cost is not None and letters > max_cost:
+                raise APIError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE,
+                               f"Batch of {letters} letters exceeds the {operation} limit of {max_cost}",
+                               {"max_letters": max_cost})
+        admitted = []
+        try:
+            for operation in operations:
+                self.limiter.acquire(operation, client, letters)
+                admitted.append(operation)
+        except RateLimited as e:
+            for operation in admitted:  # a refused request uses up none of its tokens
+                self.limiter.release(operation, client, letters)
+            raise APIError(HTTPStatus.TOO_MANY_REQUESTS, str(e), {"retry_after": round(e.retry_after, 3)})
+
+    async def run_in_pool(self, func, *args):
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.pool, func, *args)
+        except UnicodeEncodeError:
+            raise APIError(HTTPStatus.UNPROCESSABLE_ENTITY, "Letter contains characters the PDF font cannot encode")
+
+    @staticmethod
+    def parse_json(body):
+        try:
+            payload = json.loads(body)
+        except (ValueError, UnicodeDecodeError):
+            raise APIError(HTTPStatus.BAD_REQUEST, "Body must be valid JSON")
+        if not isinstance(payload, dict):
+            raise APIError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object")
+        return payload
+
+    @staticmethod
+    def output_format(payload, allowed):
+        output_format = payload.get("format", "text")
+        if output_format not in allowed:
+            raise APIError(HTTPStatus.UNPROCESSABLE_ENTITY,
+                           f"Unknown format {output_format!r}, expected one of {sorted(allowed)}")
+        return output_format
+
+    @staticmethod
+    def error_body(message, details=None):
+        error = {"error": message}
+        if details is not None:
+            error["details"] = details
+        return "application/json", json.dumps(error).encode("utf-8")
+
+    @staticmethod
+    async def send(writer, status, content_type, payload, keep_alive):
+        head = (
+            f"HTTP/1.1 {status.value} {status.phrase}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n"
+        )
+        writer.write(head.encode("latin1") + payload)
+        await writer.drain()
+
+
+async def serve(host, port, workers):
+    server = await LetterAPIServer(host, port, workers).start()
+    print(f"Serving letters on http://{server.host}:{server.port}")
+    try:
+        # Stop on SIGTERM as on Ctrl-C, so the worker processes are shut down rather than orphaned
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except (NotImplementedError, AttributeError):  # Windows
+        pass
+    try:
+        await server.serve_forever()
+    finally:
+        server.pool.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="HTTP API for letter generation")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=None, help="PDF worker processes (default: CPU count)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""Compare the metric-based PDF layout with the original 80-character loop.
+
+Usage:
+    python -m benchmarks.layout [--repeat 3]
+"""
+import argparse
+import time
+
+from fpdf import FPDF
+
+from letter_core import PDFGenerator
+
+SIZES = [1_000, 10_000, 100_000, 1_000_000]
+PARAGRAPH = (
+    "I am writing to formally request leave from my duties for the period mentioned below. "
+    "I have ensured that all my current responsibilities will be appropriately managed during "
+    "my absence, and I will coordinate with my colleagues to ensure minimal disruption.\n\n"
+)
+
+
+def legacy_layout(letter_content):
+    """The character-count wrapping loop PDFGenerator used before TextLayout"""
+    pdf = FPDF()
+    pdf.add_page()
+    pdf.set_font("Arial", size=12)
+    for line in letter_content.split('\n'):
+        if len(line) > 80:
+            current_line = ""
+            for word in line.split(' '):
+                if len(current_line + word) < 80:
+                    current_line += word + " "
+                else:
+                    pdf.cell(200, 10, txt=current_line.strip(), ln=True, align='L')
+                    current_line = word + " "
+            if current_line:
+                pdf.cell(200, 10, txt=current_line.strip(), ln=True, align='L')
+        else:
+            pdf.cell(200, 10, txt=line, ln=True, align='L')
+    return pdf
+
+
+def make_letter(size):
+    """Letter text of roughly size bytes"""
+    return (PARAGRAPH * (size // len(PARAGRAPH) + 1))[:size]
+
+
+def best_time(func, arg, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    pdf_gen = PDFGenerator()
+    print(f"{'size':>9} {'legacy s':>10} {'pages':>6} {'layout s':>10} {'pages':>6} {'speedup':>8}")
+    for size in SIZES:
+        letter = make_letter(size)
+        legacy_time, legacy_pdf = best_time(legacy_layout, letter, args.repeat)
+        new_time, new_pdf = best_time(pdf_gen.layout, letter, args.repeat)
+        print(f"{size:>9} {legacy_time:>10.4f} {legacy_pdf.page:>6} {new_time:>10.4f} {new_pdf.page:>6} "
+              f"{legacy_time / new_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""Compare the memory held by UserManager's records with plain users.json dicts.
+
+Each form is loaded in a fresh process and measured by its peak resident size.
+
+Usage:
+    python -m benchmarks.memory [--scales 100000,1000000]
+"""
+import argparse
+import json
+import resource
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+
+from user_records import User
+
+SCALES = [100_000, 1_000_000]
+TYPES = ["Application for Leave", "Job Application", "Resignation Letter", "Complaint Letter"]
+STYLES = ["standard", "professional", "short"]
+
+
+def user_json(i):
+    """One user as users.json would hold it, with two templates of varied type, style and dates"""
+    created = datetime(2025, 1, 2) + timedelta(seconds=i * 37, microseconds=i % 1_000_000)
+    return json.dumps({
+        "password": f"{i * 2654435761 % 2 ** 256:064x}", "email": f"user{i}@example.com",
+        "full_name": f"User {i}", "created_at": created.isoformat(),
+        "templates": {
+            f"letter{j}": {
+                "type": TYPES[(i + j) % len(TYPES)], "style": STYLES[(i + j) % len(STYLES)],
+                "data": {"name": f"User {i}", "organization": "Acme Corp", "from_date": "2025-01-02"},
+                "created_at": (created + timedelta(days=j)).isoformat(),
+                "content_ref": f"{(i + j) % 50:064x}",
+            }
+            for j in range(2)
+        },
+    })
+
+
+def build(scale, compact):
+    """Peak resident bytes added by loading scale users, run in a fresh worker process"""
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    load = User.from_json if compact else (lambda user: user)
+    users = {f"user{i}": load(json.loads(user_json(i))) for i in range(scale)}
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    assert len(users) == scale
+    return (peak - baseline) * (1 if sys.platform == "darwin" else 1024)  # ru_maxrss is KiB on Linux
+
+
+def measure(scale, compact):
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(build, scale, compact).result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scales", default=",".join(str(scale) for scale in SCALES))
+    args = parser.parse_args(argv)
+
+    print(f"{'users':>9} {'dicts MB':>10} {'records MB':>11} {'B/user':>8} {'B/user':>8} {'saving':>7}")
+    for scale in [int(scale) for scale in args.scales.split(",")]:
+        dicts = measure(scale, compact=False)
+        records = measure(scale, compact=True)
+        print(f"{scale:>9} {dicts / 1e6:>10.1f} {records / 1e6:>11.1f} {dicts / scale:>8.0f} {records / scale:>8.0f} "
+              f"{1 - records / dicts:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
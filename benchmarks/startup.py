@@ -0,0 +1,77 @@
+"""Check the cold-start import time of each entry point against its budget.
+
+Usage:
+    python -m benchmarks.startup [--runs 5] [--budget core=100 --budget ui=2500]
+
+Each module is imported in a fresh interpreter under `python -X importtime`
+and the fastest of --runs imports is compared with the budget, in
+milliseconds, of its entry point. The core and CLI entry points must also
+not import fpdf or Streamlit. A first warm-up import per module writes the
+bytecode cache, so compilation is not counted. Exits with status 1 if any
+entry point is over budget.
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+# entry point: (modules, budget in ms, top-level packages it must not import)
+ENTRY_POINTS = {
+    "core": (["letter_core"], 100, {"fpdf", "streamlit"}),
+    "cli": (["mail_merge", "jobs", "api_server", "migrate_users"], 250, {"fpdf", "streamlit"}),
+    "ui": (["app"], 2500, set()),
+}
+
+
+def import_profile(module):
+    """(cumulative import time in ms, top-level packages imported) of one fresh import of module"""
+    env = dict(os.environ)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env=env)
+    if result.returncode:
+        raise RuntimeError(f"importing {module} failed:\n{result.stderr}")
+    total = None
+    packages = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        packages.add(name.strip().split(".")[0])
+        if name.strip() == module:
+            total = int(cumulative) / 1000
+    return total, packages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget", action="append", default=[], metavar="ENTRY=MS",
+                        help=f"override the budget of one of {list(ENTRY_POINTS)}")
+    args = parser.parse_args(argv)
+    budgets = {entry: budget for entry, (_, budget, _) in ENTRY_POINTS.items()}
+    for override in args.budget:
+        entry, _, milliseconds = override.partition("=")
+        if entry not in budgets:
+            parser.error(f"unknown entry point {entry!r}, expected one of {list(ENTRY_POINTS)}")
+        budgets[entry] = float(milliseconds)
+
+    failed = False
+    print(f"{'entry':<6} {'module':<16} {'ms':>8} {'budget':>8}")
+    for entry, (modules, _, forbidden) in ENTRY_POINTS.items():
+        for module in modules:
+            import_profile(module)
+            profiles = [import_profile(module) for _ in range(args.runs)]
+            milliseconds = min(total for total, _ in profiles)
+            leaked = sorted(forbidden & profiles[0][1])
+            over = milliseconds > budgets[entry]
+            failed = failed or over or bool(leaked)
+            note = "  OVER BUDGET" if over else ""
+            if leaked:
+                note += f"  imports {', '.join(leaked)}"
+            print(f"{entry:<6} {module:<16} {milliseconds:>8.1f} {budgets[entry]:>8.0f}{note}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,219 @@
+"""Benchmark the hot paths and compare the results with a saved baseline.
+
+Usage:
+    python -m benchmarks.suite --output bench_results.json
+    python -m benchmarks.suite --baseline bench_results.json --threshold 0.10
+    python -m benchmarks.suite --only users --stores json,sqlite,sharded --scales 1000,100000,1000000
+
+Times every LetterTemplates.generate_* method in every style, uncached and as
+render cache hits, single- and mixed-locale batches, PDFGenerator.create_pdf
+across letter sizes, and UserManager load (opening the store and the first
+login)/register/login/save-template on the JSON, SQLite and sharded stores
+seeded with N users holding one template each. Each result is the median
+seconds per operation. With --baseline, any result slower than the baseline by
+more than --threshold is reported and the exit status is 1.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+from benchmarks.layout import make_letter
+from letter_core import (LETTER_LOCALES, LETTER_STYLES, LetterTemplates, PDFGenerator, RenderCache,
+                         ShardedUserManager, SQLiteUserManager, UserManager)
+
+DEFAULT_SCALES = [1_000, 100_000]
+FULL_SCALES = [1_000, 100_000, 1_000_000]
+PDF_SIZES = [1_000, 10_000, 100_000, 1_000_000]
+SAMPLE_DATE = date(2025, 1, 2)
+TEMPLATE_SAMPLES = {
+    "generate_leave_application": {
+        "name": "Alex Doe", "reason": "a family event", "from_date": SAMPLE_DATE, "to_date": SAMPLE_DATE,
+        "organization": "Acme Corp", "position": "Engineer", "manager_name": "Sam Lee",
+    },
+    "generate_internship_request": {
+        "name": "Alex Doe", "university": "State University", "course": "Computer Science",
+        "email": "alex@example.com", "company": "Acme Corp", "duration": "3 months",
+        "department": "Research", "skills": "Python, SQL",
+    },
+    "generate_job_application": {
+        "name": "Alex Doe", "position": "Engineer", "experience": "5", "email": "alex@example.com",
+        "company": "Acme Corp", "phone": "555-0100", "qualifications": "Python, SQL", "reference": "A friend",
+    },
+    "generate_resignation_letter": {
+        "name": "Alex Doe", "position": "Engineer", "last_day": SAMPLE_DATE, "manager_name": "Sam Lee",
+        "company": "Acme Corp", "reason": "relocation",
+    },
+    "generate_complaint_letter": {
+        "name": "Alex Doe", "recipient": "Support", "issue": "The delivery arrived damaged and late.",
+        "organization": "Acme Corp", "date_occurred": SAMPLE_DATE, "resolution": "A replacement",
+    },
+    "generate_appreciation_letter": {
+        "name": "Alex Doe", "recipient": "Sam Lee", "achievement": "Shipping the release early",
+        "organization": "Acme Corp", "relationship": "a teammate", "impact": "Customers got fixes sooner",
+    },
+}
+SEED_TEMPLATE = {
+    "type": "Application for Leave", "style": "standard",
+    "content": "Date: January 02, 2025\n\nTo: The Manager\nAcme Corp\n\nSubject: Application for Leave",
+    "data": {"name": "Alex Doe", "from_date": "2025-01-02"}, "created_at": "2025-01-02T00:00:00",
+}
+
+
+def time_per_op(func, number=1, repeat=5):
+    """Median and minimum seconds per call of func over repeat rounds of number calls"""
+    rounds = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            func()
+        rounds.append((time.perf_counter() - start) / number)
+    return {"seconds": statistics.median(rounds), "min_seconds": min(rounds), "number": number, "repeat": repeat}
+
+
+def bench_templates(results):
+    uncached = RenderCache(max_entries=0)
+    cached = RenderCache()
+    for method, data in TEMPLATE_SAMPLES.items():
+        generate = getattr(LetterTemplates, method)
+        for style in LETTER_STYLES:
+            results[f"templates/{method}/{style}"] = time_per_op(
+                lambda: generate(data, style, SAMPLE_DATE, uncached), number=2000)
+            results[f"templates_cached/{method}/{style}"] = time_per_op(
+                lambda: generate(data, style, SAMPLE_DATE, cached), number=2000)
+    # Per letter, a batch cycling through every locale should cost the same as a single-locale one
+    batch = [(getattr(LetterTemplates, method), data) for method, data in TEMPLATE_SAMPLES.items()]
+    for name, locales in [("single_locale", LETTER_LOCALES[:1]), ("mixed_locale", LETTER_LOCALES)]:
+        def render_batch():
+            for index, (generate, data) in enumerate(batch * 10):
+                generate(data, "standard", SAMPLE_DATE, uncached, locales[index % len(locales)])
+        results[f"templates/batch/{name}"] = time_per_op(render_batch, number=20)
+
+
+def bench_pdf(results):
+    pdf_gen = PDFGenerator()
+    for size in PDF_SIZES:
+        letter = make_letter(size)
+        number = max(1, 100_000 // size)
+        results[f"pdf/create_pdf/{size}"] = time_per_op(lambda: pdf_gen.create_pdf(letter), number=number)
+
+
+def seed_users(count):
+    """users.json contents with count users holding one template each"""
+    password = UserManager.hash_password(None, "password")
+    return {
+        f"user{i}": {
+            "password": password, "email": f"user{i}@example.com", "full_name": f"User {i}",
+            "templates": {"leave": SEED_TEMPLATE}, "created_at": "2025-01-02T00:00:00",
+        }
+        for i in range(count)
+    }
+
+
+def open_store(store, directory, users):
+    """Create a store of the given kind seeded with users, returning a factory that opens it"""
+    if store == "json":
+        path = os.path.join(directory, "users.json")
+        with open(path, "w") as f:
+            json.dump(users, f)
+        return lambda: UserManager(path)
+    if store == "sharded":
+        path = os.path.join(directory, "users")
+        ShardedUserManager(path).import_users(users)
+        return lambda: ShardedUserManager(path)
+    path = os.path.join(directory, "users.db")
+    SQLiteUserManager(path).import_users(users)
+    return lambda: SQLiteUserManager(path)
+
+
+def bench_users(results, stores, scales):
+    for store in stores:
+        for scale in scales:
+            with tempfile.TemporaryDirectory() as directory:
+                open_manager = open_store(store, directory, seed_users(scale))
+                prefix = f"users/{store}/{scale}"
+                # Writes rewrite the whole file for the JSON store, so fewer rounds at large scales
+                repeat = 3 if scale >= 100_000 else 5
+                # Stores read lazily, so load includes the first login, which reads what it needs
+                results[f"{prefix}/load"] = time_per_op(
+                    lambda: open_manager().login_user(f"user{scale // 2}", "password"), repeat=repeat)
+                manager = open_manager()
+                counter = iter(range(10 ** 9))
+                results[f"{prefix}/register"] = time_per_op(
+                    lambda: manager.register_user(f"new{next(counter)}", "password", "new@example.com", "New"),
+                    repeat=repeat)
+                results[f"{prefix}/login"] = time_per_op(
+                    lambda: manager.login_user(f"user{scale // 2}", "password"), number=1000)
+                results[f"{prefix}/save_template"] = time_per_op(
+                    lambda: manager.save_user_template(f"user{scale // 2}", f"t{next(counter)}", SEED_TEMPLATE),
+                    repeat=repeat)
+                results[f"{prefix}/get_user_templates"] = time_per_op(
+                    lambda: manager.get_user_templates(f"user{scale // 2}"), number=1000)
+                print(f"  {prefix} done", file=sys.stderr)
+
+
+def compare(results, baseline, threshold):
+    """Rows of (name, baseline, current, ratio, regressed) for results present in both runs"""
+    rows = []
+    for name, result in results.items():
+        if name in baseline:
+            ratio = result["seconds"] / baseline[name]["seconds"] if baseline[name]["seconds"] else 1.0
+            rows.append((name, baseline[name]["seconds"], result["seconds"], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the Smart Letter Generator benchmarks")
+    parser.add_argument("--output", default="bench_results.json", help="Where to write this run's results")
+    parser.add_argument("--baseline", help="Results file of a previous run to compare against")
+    parser.add_argument("--threshold", type=float, default=0.10,
+                        help="Allowed slowdown before a result counts as a regression (0.10 = 10%%)")
+    parser.add_argument("--only", default="templates,pdf,users", help="Comma separated sections to run")
+    parser.add_argument("--stores", default="json,sqlite,sharded", help="User stores to benchmark")
+    parser.add_argument("--scales", default=None,
+                        help="Comma separated user counts (default 1000,100000)")
+    parser.add_argument("--full", action="store_true", help="Also benchmark stores with 1,000,000 users")
+    args = parser.parse_args(argv)
+
+    sections = set(args.only.split(","))
+    scales = [int(s) for s in args.scales.split(",")] if args.scales else (FULL_SCALES if args.full else DEFAULT_SCALES)
+    results = {}
+    if "templates" in sections:
+        bench_templates(results)
+    if "pdf" in sections:
+        bench_pdf(results)
+    if "users" in sections:
+        bench_users(results, args.stores.split(","), scales)
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "meta": {
+                "created_at": datetime.now().isoformat(), "python": platform.python_version(),
+                "platform": platform.platform(),
+            },
+            "results": results,
+        }, f, indent=2)
+
+    if not args.baseline:
+        for name, result in results.items():
+            print(f"{name:<55} {result['seconds'] * 1e6:>14.1f} us")
+        return 0
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)["results"]
+    rows = compare(results, baseline, args.threshold)
+    for name, before, after, ratio, regressed in rows:
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:<55} {before * 1e6:>14.1f} {after * 1e6:>14.1f} us {ratio:>6.2f}x {flag}")
+    regressions = [row for row in rows if row[4]]
+    print(f"{len(rows)} compared, {len(regressions)} regressions above {args.threshold:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,249 @@
+"""Resumable bulk letter jobs with progress checkpointed in SQLite.
+
+Usage:
+    python jobs.py submit hr_export.csv --letter-type "Application for Leave" --output-dir letters
+    python jobs.py resume JOB_ID
+    python jobs.py status [JOB_ID]
+
+A job records its settings and the outcome of every input row in jobs.db. Rows
+are read in chunks by an asyncio producer and rendered on a process pool; the
+bounded queue between them applies backpressure so the reader never runs far
+ahead of the workers. Each finished chunk is committed as one checkpoint, so
+an interrupted job resumes by skipping the rows it already finished.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from itertools import islice
+
+from letter_core import DEFAULT_LOCALE, LETTER_FIELDS, LETTER_LOCALES, LETTER_STYLES
+from mail_merge import iter_records, render_chunk
+
+# Only per-letter outputs can be resumed; a half-written archive cannot be appended to
+JOB_FORMATS = ["text", "pdf"]
+
+
+class JobStore:
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            id TEXT PRIMARY KEY,
+            input_path TEXT NOT NULL,
+            letter_type TEXT NOT NULL,
+            style TEXT NOT NULL,
+            output_format TEXT NOT NULL,
+            output_dir TEXT NOT NULL,
+            chunk_size INTEGER NOT NULL,
+            render_date TEXT NOT NULL,
+            locale TEXT NOT NULL,
+            status TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            updated_at TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS records (
+            job_id TEXT NOT NULL,
+            row INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            errors TEXT,
+            PRIMARY KEY (job_id, row)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, db_file="jobs.db"):
+        self.connection = sqlite3.connect(db_file, timeout=30)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.executescript(self.SCHEMA)
+
+    def create_job(self, input_path, letter_type, style="standard", output_format="text",
+                   output_dir="letters", chunk_size=500, render_date=None, locale=DEFAULT_LOCALE):
+        """Register a new pending job and return its id; render_date is fixed so resumed runs match"""
+        if letter_type not in LETTER_FIELDS:
+            raise ValueError(f"Unknown letter type '{letter_type}'")
+        if output_format not in JOB_FORMATS:
+            raise ValueError(f"Jobs support the {JOB_FORMATS} formats, not '{output_format}'")
+        job_id = uuid.uuid4().hex[:12]
+        now = datetime.now().isoformat()
+        with self.connection:
+            self.connection.execute(
+                "INSERT INTO jobs (id, input_path, letter_type, style, output_format, output_dir, chunk_size, "
+                "render_date, locale, status, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?)",
+                (job_id, os.path.abspath(input_path), letter_type, style, output_format, os.path.abspath(output_dir),
+                 chunk_size, (render_date or date.today()).isoformat(), locale, now, now)
+            )
+        return job_id
+
+    def get_job(self, job_id):
+        row = self.connection.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def list_jobs(self):
+        return [dict(row) for row in self.connection.execute("SELECT * FROM jobs ORDER BY created_at")]
+
+    def set_status(self, job_id, status):
+        with self.connection:
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, updated_at = ? WHERE id = ?",
+                (status, datetime.now().isoformat(), job_id)
+            )
+
+    def finished_rows(self, job_id, first_row, last_row):
+        """Rows in [first_row, last_row] that already have an outcome"""
+        return {row for (row,) in self.connection.execute(
+            "SELECT row FROM records WHERE job_id = ? AND row BETWEEN ? AND ?", (job_id, first_row, last_row)
+        )}
+
+    def checkpoint(self, job_id, rows, errors):
+        """Record the outcome of one rendered chunk in a single transaction"""
+        errors = dict(errors)
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO records (job_id, row, status, errors) VALUES (?, ?, ?, ?)",
+                ((job_id, row, "failed" if row in errors else "done",
+                  json.dumps(errors[row]) if row in errors else None) for row in rows)
+            )
+            self.connection.execute(
+                "UPDATE jobs SET updated_at = ? WHERE id = ?", (datetime.now().isoformat(), job_id)
+            )
+
+    def progress(self, job_id):
+        """Counts of finished rows by outcome"""
+        counts = {"done": 0, "failed": 0}
+        for status, count in self.connection.execute(
+            "SELECT status, COUNT(*) FROM records WHERE job_id = ? GROUP BY status", (job_id,)
+        ):
+            counts[status] = count
+        return counts
+
+    def failures(self, job_id, limit=100):
+        """(row, errors) of failed rows, in input order"""
+        return [(row, json.loads(errors)) for row, errors in self.connection.execute(
+            "SELECT row, errors FROM records WHERE job_id = ? AND status = 'failed' ORDER BY row LIMIT ?",
+            (job_id, limit)
+        )]
+
+
+async def run_job(store, job_id, workers=None, progress=None):
+    """Render every unfinished row of a job, checkpointing after each chunk.
+
+    Returns the final progress counts. If the run fails or is cancelled the
+    job is marked interrupted and can be resumed with another run_job call.
+    """
+    job = store.get_job(job_id)
+    if job is None:
+        raise KeyError(f"No job '{job_id}'")
+    counts = store.progress(job_id)
+    if job["status"] == "completed":
+        return counts
+    workers = workers or os.cpu_count() or 1
+    render_date = date.fromisoformat(job["render_date"])
+    os.makedirs(job["output_dir"], exist_ok=True)
+    store.set_status(job_id, "running")
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue(maxsize=workers * 2)
+    records = enumerate(iter_records(job["input_path"]), start=1)
+
+    async def produce():
+        while True:
+            chunk = await loop.run_in_executor(None, lambda: list(islice(records, job["chunk_size"])))
+            if not chunk:
+                break
+            finished = store.finished_rows(job_id, chunk[0][0], chunk[-1][0])
+            todo = [item for item in chunk if item[0] not in finished]
+            if todo:
+                await queue.put(todo)
+        for _ in range(workers):
+            await queue.put(None)
+
+    async def consume(pool):
+        while (chunk := await queue.get()) is not None:
+            _, rendered, errors, _ = await loop.run_in_executor(
+                pool, render_chunk, job["letter_type"], job["style"], job["output_format"], job["output_dir"], chunk,
+                render_date, job["locale"]
+            )
+            store.checkpoint(job_id, [row for row, _ in chunk], errors)
+            counts["done"] += rendered
+            counts["failed"] += len(errors)
+            if progress:
+                progress(counts)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            async with asyncio.TaskGroup() as group:
+                group.create_task(produce())
+                for _ in range(workers):
+                    group.create_task(consume(pool))
+    except BaseException:
+        store.set_status(job_id, "interrupted")
+        raise
+    store.set_status(job_id, "completed")
+    return counts
+
+
+def print_job(store, job):
+    counts = store.progress(job["id"])
+    print(f"{job['id']}  {job['status']:<11}  done {counts['done']}  failed {counts['failed']}  "
+          f"{job['letter_type']} ({job['style']}, {job['locale']}, {job['output_format']})  {job['input_path']} -> {job['output_dir']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Resumable bulk letter generation jobs")
+    parser.add_argument("--db", default="jobs.db", help="SQLite file holding job state")
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit = commands.add_parser("submit", help="Create a job and run it")
+    submit.add_argument("input", help="CSV or JSONL file with one letter per row")
+    submit.add_argument("--letter-type", required=True, choices=list(LETTER_FIELDS))
+    submit.add_argument("--style", default="standard", choices=LETTER_STYLES)
+    submit.add_argument("--format", dest="output_format", default="text", choices=JOB_FORMATS)
+    submit.add_argument("--output-dir", default="letters")
+    submit.add_argument("--chunk-size", type=int, default=500)
+    submit.add_argument("--date", type=date.fromisoformat, default=None,
+                        help="Date printed on every letter, YYYY-MM-DD (default: today)")
+    submit.add_argument("--locale", default=DEFAULT_LOCALE, choices=LETTER_LOCALES)
+    submit.add_argument("--workers", type=int, default=None)
+    resume = commands.add_parser("resume", help="Continue an interrupted job")
+    resume.add_argument("job_id")
+    resume.add_argument("--workers", type=int, default=None)
+    status = commands.add_parser("status", help="Show job progress")
+    status.add_argument("job_id", nargs="?")
+    args = parser.parse_args(argv)
+
+    store = JobStore(args.db)
+    if args.command == "status":
+        jobs = [store.get_job(args.job_id)] if args.job_id else store.list_jobs()
+        for job in jobs:
+            if job is None:
+                print(f"No job '{args.job_id}'", file=sys.stderr)
+                return 1
+            print_job(store, job)
+        return 0
+
+    if args.command == "submit":
+        job_id = store.create_job(args.input, args.letter_type, args.style, args.output_format,
+                                  args.output_dir, args.chunk_size, args.date, args.locale)
+        print(f"Job {job_id}", file=sys.stderr)
+    else:
+        job_id = args.job_id
+
+    def progress(counts):
+        print(f"\rdone {counts['done']}  failed {counts['failed']}", end="", file=sys.stderr, flush=True)
+
+    try:
+        asyncio.run(run_job(store, job_id, args.workers, progress))
+    except KeyboardInterrupt:
+        print(f"\nInterrupted; continue with: python jobs.py resume {job_id}", file=sys.stderr)
+        return 130
+    print(file=sys.stderr)
+    print_job(store, store.get_job(job_id))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
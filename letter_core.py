@@ -0,0 +1,2016 @@
+"""Letter rendering, PDF output and user storage, without any Streamlit UI.
+
+app.py builds the Streamlit interface on top of this module; the CLI, API
+server, jobs and benchmarks import it directly. Importing it loads and
+compiles the letter templates (see letter_templates) and creates the
+process-wide caches, but opens no files or connections for them; fpdf,
+the slowest dependency, is only imported on the first PDF render (see
+pdf_classes).
+"""
+from datetime import datetime, date
+import json
+import os
+import re
+import sqlite3
+import sys
+import zipfile
+import zlib
+from array import array
+import hashlib
+import atexit
+import copy
+import pickle
+import tempfile
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import lru_cache
+
+import metrics
+from letter_templates import DEFAULT_LOCALE, LETTER_FIELDS, LETTER_LOCALES, LETTER_STYLES, TEMPLATE_REGISTRY
+from user_records import SavedTemplate, User, gc_paused, users_from_json, users_to_json
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+EMAIL_PATTERN = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s.]+")
+
+class LetterSchema:
+    """Validation rules of one letter type, compiled from its field definitions in LETTER_FIELDS.
+
+    Checks required fields, value types, max_length, date formats and order
+    ("after") and email addresses. Rows are validated a column at a time, so
+    a large import is checked in one pass per field rather than re-reading
+    every field's rules for every row.
+    """
+    _instances = {}
+
+    def __init__(self, fields):
+        self.fields = fields
+        self.orderings = [(field, spec["after"]) for field, spec in fields.items() if spec.get("after")]
+
+    @classmethod
+    def for_letter_type(cls, letter_type):
+        """Schema of a letter type, rebuilt when its template files are reloaded"""
+        TEMPLATE_REGISTRY.maybe_refresh()
+        key = (letter_type, TEMPLATE_REGISTRY.generation)
+        schema = cls._instances.get(key)
+        if schema is None:
+            schema = cls(LETTER_FIELDS[letter_type])
+            cls._instances = {cached: value for cached, value in cls._instances.items()
+                              if cached[1] == TEMPLATE_REGISTRY.generation}
+            cls._instances[key] = schema
+        return schema
+
+    def validate(self, record):
+        """(letter_data, errors) of one {field: value} record"""
+        columns, errors = self.validate_columns({field: [record.get(field)] for field in self.fields}, 1)
+        letter_data = {field: values[0] for field, values in columns.items() if values[0] is not None}
+        return letter_data, errors.get(0, [])
+
+    def validate_records(self, records):
+        """[(letter_data, errors)] of a list of records, validated column by column"""
+        columns = {field: [record.get(field) for record in records] for field in self.fields}
+        columns, errors = self.validate_columns(columns, len(records))
+        return [({field: values[row] for field, values in columns.items() if values[row] is not None},
+                 errors.get(row, [])) for row in range(len(records))]
+
+    def validate_columns(self, columns, row_count):
+        """Validate {field: values of row_count rows}.
+
+        Returns ({field: parsed values}, {row: errors}); a parsed value is
+        None where the field is empty or invalid. Values may be strings
+        (dates in ISO format), numbers or date objects; strings are stripped,
+        so one of only whitespace is empty.
+        """
+        errors = defaultdict(list)
+        parsed = {}
+        for field, spec in self.fields.items():
+            values = columns.get(field) or [None] * row_count
+            required = spec["required"]
+            field_type = spec["type"]
+            max_length = spec["max_length"]
+            output = [None] * row_count
+            for row, value in enumerate(values):
+                if type(value) is str:
+                    value = value.strip()
+                if value is None or value == "":
+                    if required:
+                        errors[row].append(f"missing required field '{field}'")
+                    continue
+                if type(value) is not str:
+                    if isinstance(value, (list, dict, tuple, set, bytes)):
+                        errors[row].append(f"'{field}' must be a single {field_type} value")
+                        continue
+                    value = str(value)
+                if len(value) > max_length:
+                    errors[row].append(f"'{field}' is longer than {max_length} characters")
+                    continue
+                if field_type == "date":
+                    try:
+                        value = date.fromisoformat(value)
+                    except ValueError:
+                        errors[row].append(f"invalid date for '{field}': {value!r}")
+                        continue
+                elif field_type == "email" and not EMAIL_PATTERN.fullmatch(value):
+                    errors[row].append(f"invalid email address for '{field}': {value!r}")
+                    continue
+                output[row] = value
+            parsed[field] = output
+        for field, earlier in self.orderings:
+            for row, (start, end) in enumerate(zip(parsed[earlier], parsed[field])):
+                if start is not None and end is not None and end < start:
+                    errors[row].append(f"'{field}' must not be before '{earlier}'")
+        return parsed, errors
+
+def validate_letter_data(letter_type, record):
+    """Check raw field values against the letter's schema, returning (letter_data, errors).
+
+    Values may be strings (dates in ISO format) or date objects. Empty
+    optional fields are left out so the templates fall back to their defaults.
+    """
+    return LetterSchema.for_letter_type(letter_type).validate(record)
+
+class RenderCache:
+    """Bounded LRU cache of rendered letters keyed on their normalized inputs"""
+
+    def __init__(self, max_entries=4096):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(letter_type, style, data, render_date, locale=DEFAULT_LOCALE):
+        """Key independent of field order; raises TypeError for unhashable field values"""
+        key = (TEMPLATE_REGISTRY.generation, letter_type, locale, style, render_date.toordinal(),
+               tuple(sorted(data.items())))
+        hash(key)
+        return key
+
+    def get(self, key):
+        """Return the cached letter or None, marking the entry as recently used"""
+        with self.lock:
+            letter = self.entries.get(key)
+            if letter is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return letter
+
+    def put(self, key, letter):
+        """Store a letter, evicting the least recently used entries beyond max_entries"""
+        with self.lock:
+            self.entries[key] = letter
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        """Snapshot of cache counters"""
+        with self.lock:
+            return {
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "max_entries": self.max_entries
+            }
+
+# Shared by the batch and API paths; the Streamlit app keeps its own in get_render_cache
+RENDER_CACHE = RenderCache(int(os.environ.get("RENDER_CACHE_SIZE", 4096)))
+
+class SharedCache:
+    """Size-bounded LRU cache of versioned bytes in an SQLite file shared by every process on the host.
+
+    It holds pickled user records, so the file must only be writable by the app. Database errors count as misses.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS entries (
+            namespace TEXT NOT NULL,
+            key TEXT NOT NULL,
+            version TEXT NOT NULL,
+            value BLOB NOT NULL,
+            size INTEGER NOT NULL,
+            accessed REAL NOT NULL,
+            PRIMARY KEY (namespace, key)
+        );
+        CREATE INDEX IF NOT EXISTS entries_by_access ON entries (accessed);
+        CREATE TABLE IF NOT EXISTS usage (id INTEGER PRIMARY KEY CHECK (id = 0), bytes INTEGER NOT NULL);
+        INSERT OR IGNORE INTO usage (id, bytes) VALUES (0, 0);
+    """
+    ACCESS_RESOLUTION = 10.0  # seconds; reads refresh an entry's access time at most this often
+
+    def __init__(self, db_file="letter_cache.db", max_bytes=256 * 1024 * 1024):
+        self.db_file = db_file
+        self.max_bytes = max_bytes
+        self.local = threading.local()
+        self.versions = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self.errors = 0
+
+    @property
+    def connection(self):
+        """Connection for the current thread, opened on first use; raises sqlite3.Error, so only use it in a try"""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_file, timeout=1, isolation_level=None)
+            try:
+                connection.execute("PRAGMA journal_mode=WAL")
+                connection.execute("PRAGMA synchronous=NORMAL")
+                connection.executescript(self.SCHEMA)
+            except sqlite3.Error:
+                connection.close()
+                raise
+            self.local.connection = connection
+        return connection
+
+    def _count(self, name, amount=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + amount)
+
+    def get(self, namespace, key, version):
+        """Bytes stored under key for version, or None"""
+        try:
+            row = self.connection.execute(
+                "SELECT version, value, accessed FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+            ).fetchone()
+            if row is None or row[0] != version:
+                self._count("misses")
+                return None
+            now = time.time()
+            if now - row[2] > self.ACCESS_RESOLUTION:
+                self.connection.execute(
+                    "UPDATE entries SET accessed = ? WHERE namespace = ? AND key = ?", (now, namespace, key)
+                )
+        except sqlite3.Error:
+            self._count("errors")
+            return None
+        self._count("hits")
+        return row[1]
+
+    def put(self, namespace, key, version, value):
+        """Store value under key for version, replacing any other version, and evict beyond max_bytes"""
+        if len(value) > self.max_bytes:
+            return
+        try:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                old = connection.execute(
+                    "SELECT size FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+                ).fetchone()
+                connection.execute(
+                    "INSERT OR REPLACE INTO entries (namespace, key, version, value, size, accessed) "
+                    "VALUES (?, ?, ?, ?, ?, ?)", (namespace, key, version, value, len(value), time.time())
+                )
+                used = self._add_usage(len(value) - (old[0] if old else 0))
+                evicted = 0
+                while used > self.max_bytes:
+                    victims = []
+                    freed = 0
+                    for rowid, size in connection.execute(
+                        "SELECT rowid, size FROM entries ORDER BY accessed LIMIT 64"
+                    ).fetchall():
+                        victims.append((rowid,))
+                        freed += size
+                        if used - freed <= self.max_bytes:
+                            break
+                    if not victims:
+                        # The counter was out of step with the entries, e.g. after a crash; recount and stop
+                        used = self._recount_usage()
+                        break
+                    connection.executemany("DELETE FROM entries WHERE rowid = ?", victims)
+                    used = self._add_usage(-freed)
+                    evicted += len(victims)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            self._count("errors")
+            return
+        self._count("puts")
+        if evicted:
+            self._count("evictions", evicted)
+
+    def _add_usage(self, delta):
+        self.connection.execute("UPDATE usage SET bytes = bytes + ? WHERE id = 0", (delta,))
+        return self.connection.execute("SELECT bytes FROM usage WHERE id = 0").fetchone()[0]
+
+    def _recount_usage(self):
+        self.connection.execute("UPDATE usage SET bytes = (SELECT COALESCE(SUM(size), 0) FROM entries) WHERE id = 0")
+        return self.connection.execute("SELECT bytes FROM usage WHERE id = 0").fetchone()[0]
+
+    def use_version(self, namespace, version):
+        """Delete the namespace's entries of other versions the first time this process sees version"""
+        if self.versions.get(namespace) == version:
+            return
+        self.versions[namespace] = version
+        try:
+            connection = self.connection
+            connection.execute("BEGIN IMMEDIATE")
+            try:
+                freed = connection.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM entries WHERE namespace = ? AND version != ?",
+                    (namespace, version)
+                ).fetchone()[0]
+                connection.execute("DELETE FROM entries WHERE namespace = ? AND version != ?", (namespace, version))
+                self._add_usage(-freed)
+                connection.execute("COMMIT")
+            except BaseException:
+                connection.execute("ROLLBACK")
+                raise
+        except sqlite3.Error:
+            self._count("errors")
+            self.versions.pop(namespace, None)
+
+    def stats(self):
+        with self.lock:
+            stats = {"hits": self.hits, "misses": self.misses, "puts": self.puts, "evictions": self.evictions,
+                     "errors": self.errors, "max_bytes": self.max_bytes}
+        try:
+            stats["bytes"] = self.connection.execute("SELECT bytes FROM usage WHERE id = 0").fetchone()[0]
+        except sqlite3.Error:
+            pass
+        return stats
+
+# Set SHARED_CACHE_FILE to share the app's rendered letters and PDFs, and parsed users files, between processes
+SHARED_CACHE = (SharedCache(os.environ["SHARED_CACHE_FILE"],
+                            int(os.environ.get("SHARED_CACHE_MAX_BYTES", 256 * 1024 * 1024)))
+                if os.environ.get("SHARED_CACHE_FILE") else None)
+
+class LetterTemplates:
+    @staticmethod
+    def render(letter_type, style, data, render_date=None, locale=None, cache=None, shared_cache=None):
+        """Generate any letter type, memoized in cache or RENDER_CACHE and then in shared_cache if given.
+
+        render_date defaults to today and locale to DEFAULT_LOCALE.
+        """
+        render_date = render_date or date.today()
+        TEMPLATE_REGISTRY.maybe_refresh()
+        locale, style = TEMPLATE_REGISTRY.resolve(letter_type, style, locale)
+        cache = RENDER_CACHE if cache is None else cache
+        try:
+            key = cache.key(letter_type, style, data, render_date, locale)
+        except TypeError:  # unhashable field values are rendered without caching
+            key = None
+        if key is None:
+            return TEMPLATE_REGISTRY.render(letter_type, style, data, render_date, locale)
+        letter = cache.get(key)
+        if letter is None:
+            letter = LetterTemplates._render_shared(shared_cache, key, letter_type, style, data, render_date, locale)
+            cache.put(key, letter)
+        return letter
+
+    @staticmethod
+    def _render_shared(shared_cache, key, letter_type, style, data, render_date, locale):
+        """Render a letter, or fetch it from shared_cache if another process already has"""
+        if shared_cache is None:
+            return TEMPLATE_REGISTRY.render(letter_type, style, data, render_date, locale)
+        version = TEMPLATE_REGISTRY.fingerprint
+        shared_cache.use_version("letters", version)
+        # key[0] is this process's template generation; the fingerprint versions the entry instead
+        shared_key = hashlib.sha256(repr(key[1:]).encode("utf-8")).hexdigest()
+        letter = shared_cache.get("letters", shared_key, version)
+        if letter is not None:
+            return letter.decode("utf-8")
+        letter = TEMPLATE_REGISTRY.render(letter_type, style, data, render_date, locale)
+        shared_cache.put("letters", shared_key, version, letter.encode("utf-8"))
+        return letter
+
+    @staticmethod
+    def generate_leave_application(data, style="standard", render_date=None, cache=None, locale=None):
+        """Generate leave application letter"""
+        return LetterTemplates.render("Application for Leave", style, data, render_date, locale, cache)
+    
+    @staticmethod
+    def generate_internship_request(data, style="standard", render_date=None, cache=None, locale=None):
+        """Generate internship request letter"""
+        return LetterTemplates.render("Internship Request Letter", style, data, render_date, locale, cache)
+    
+    @staticmethod
+    def generate_job_application(data, style="standard", render_date=None, cache=None, locale=None):
+        """Generate job application letter"""
+        return LetterTemplates.render("Job Application Letter", style, data, render_date, locale, cache)
+    
+    @staticmethod
+    def generate_resignation_letter(data, style="standard", render_date=None, cache=None, locale=None):
+        """Generate resignation letter"""
+        return LetterTemplates.render("Resignation Letter", style, data, render_date, locale, cache)
+    
+    @staticmethod
+    def generate_complaint_letter(data, style="standard", render_date=None, cache=None, locale=None):
+        """Generate complaint letter"""
+        return LetterTemplates.render("Complaint Letter", style, data, render_date, locale, cache)
+    
+    @staticmethod
+    def generate_appreciation_letter(data, style="standard", render_date=None, cache=None, locale=None):
+        """Generate appreciation letter"""
+        return LetterTemplates.render("Appreciation Letter", style, data, render_date, locale, cache)
+
+# fpdf core font metrics used for each family name accepted by FPDF.set_font
+CORE_FONT_METRICS = {"arial": "helvetica", "helvetica": "helvetica", "times": "times", "courier": "courier"}
+# TrueType font for every PDF; without one, letters Latin-1 cannot encode use the first UNICODE_FONTS file found
+FONT_FILE = os.environ.get("LETTER_FONT_FILE")
+UNICODE_FONTS = [
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/TTF/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/truetype/noto/NotoSans-Regular.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "C:\\Windows\\Fonts\\arial.ttf",
+]
+TOUNICODE_CMAP = (
+    "/CIDInit /ProcSet findresource begin\n12 dict begin\nbegincmap\n"
+    "/CIDSystemInfo\n<</Registry (Adobe)\n/Ordering (UCS)\n/Supplement 0\n>> def\n"
+    "/CMapName /Adobe-Identity-UCS def\n/CMapType 2 def\n"
+    "1 begincodespacerange\n<0000> <FFFF>\nendcodespacerange\n"
+    "1 beginbfrange\n<0000> <FFFF> <0000>\nendbfrange\n"
+    "endcmap\nCMapName currentdict /CMap defineresource pop\nend\nend"
+).encode("latin1")
+
+def find_unicode_font():
+    """First installed font of UNICODE_FONTS, or None"""
+    return next((path for path in UNICODE_FONTS if os.path.exists(path)), None)
+
+# Bump whenever a change to layout or PDF output changes the bytes rendered for the same letter
+PDF_LAYOUT_VERSION = 1
+
+@lru_cache(maxsize=None)
+def pdf_renderer_version(font_file):
+    """Layout version, fpdf version and font file identities that PDFs rendered with font_file depend on"""
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        fpdf_version = version("fpdf")
+    except PackageNotFoundError:
+        fpdf_version = "unknown"
+    fonts = []
+    for path in (font_file, find_unicode_font()):
+        try:
+            stat = os.stat(path) if path else None
+        except OSError:
+            stat = None
+        fonts.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}" if stat else str(path))
+    identity = "\0".join([str(PDF_LAYOUT_VERSION), fpdf_version, *fonts])
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
+
+class FontSubset:
+    """Embeddable tables of one TrueType subset, ready to be written as PDF objects"""
+
+    def __init__(self, font, blocks, codes, font_stream, code_to_glyph):
+        self.font = font
+        # Subset fonts are named with a six-letter tag unique to their glyphs
+        digest = hashlib.sha256(repr(sorted(blocks)).encode()).digest()
+        self.name = "".join(chr(65 + byte % 26) for byte in digest[:6]) + "+" + font["name"]
+        self.font_file = zlib.compress(font_stream)
+        self.font_length = len(font_stream)
+        cid_to_gid = bytearray(2 * 65536)
+        for code, glyph in code_to_glyph.items():
+            cid_to_gid[2 * code] = glyph >> 8
+            cid_to_gid[2 * code + 1] = glyph & 0xFF
+        self.cid_to_gid = zlib.compress(bytes(cid_to_gid))
+        self.widths = self._widths(font["cw"], codes)
+
+    @staticmethod
+    def _widths(char_widths, codes):
+        """PDF /W array giving each run of consecutive codes its glyph widths"""
+        runs = []
+        for code in codes:
+            width = char_widths[code]
+            width = 0 if width == 65535 else width
+            if runs and runs[-1][0] + len(runs[-1][1]) == code:
+                runs[-1][1].append(width)
+            else:
+                runs.append((code, [width]))
+        return " ".join(f"{start} [{' '.join(map(str, widths))}]" for start, widths in runs)
+
+    def objects(self, numbers):
+        """Bodies of the seven objects of this font, numbered numbers[0] (the font itself) to numbers[6]"""
+        font, descendant, to_unicode, system_info, descriptor, cid_map, font_file = numbers
+        desc = self.font["desc"]
+        flags = (desc["Flags"] | 4) & ~32
+        descriptor_entries = " ".join(
+            f"/{key} {flags if key == 'Flags' else desc[key]}"
+            for key in ("Ascent", "Descent", "CapHeight", "Flags", "FontBBox", "ItalicAngle", "StemV", "MissingWidth")
+        )
+        return [
+            f"<</Type /Font /Subtype /Type0 /BaseFont /{self.name} /Encoding /Identity-H "
+            f"/DescendantFonts [{descendant} 0 R] /ToUnicode {to_unicode} 0 R>>".encode(),
+            f"<</Type /Font /Subtype /CIDFontType2 /BaseFont /{self.name} /CIDSystemInfo {system_info} 0 R "
+            f"/FontDescriptor {descriptor} 0 R /DW {desc['MissingWidth']} /W [{self.widths}] "
+            f"/CIDToGIDMap {cid_map} 0 R>>".encode(),
+            self._stream(f"<</Length {len(TOUNICODE_CMAP)}>>", TOUNICODE_CMAP),
+            b"<</Registry (Adobe) /Ordering (UCS) /Supplement 0>>",
+            f"<</Type /FontDescriptor /FontName /{self.name} {descriptor_entries} /FontFile2 {font_file} 0 R>>".encode(),
+            self._stream(f"<</Length {len(self.cid_to_gid)} /Filter /FlateDecode>>", self.cid_to_gid),
+            self._stream(f"<</Length {len(self.font_file)} /Filter /FlateDecode /Length1 {self.font_length}>>",
+                         self.font_file),
+        ]
+
+    @staticmethod
+    def _stream(dictionary, data):
+        return dictionary.encode() + b"\nstream\n" + data + b"\nendstream"
+
+class FontRegistry:
+    """TrueType fonts parsed once per process, with their embedded subsets cached.
+
+    A subset covers every glyph of each 256-character Unicode block a
+    document uses, so letters in the same scripts share one cached subset
+    rather than each re-reading and re-subsetting the font file.
+    """
+    BLOCK_SIZE = 256
+
+    def __init__(self, max_subsets=64):
+        self.max_subsets = max_subsets
+        self.fonts = {}
+        self.subsets = OrderedDict()
+        self.lock = threading.Lock()
+        self.parses = 0
+        self.hits = 0
+        self.misses = 0
+
+    def font(self, path):
+        """Metrics of the font at path in FPDF's TTF font dict format, parsed on first use"""
+        path = os.path.abspath(path)
+        with self.lock:
+            font = self.fonts.get(path)
+        if font is not None:
+            return font
+        from fpdf.ttfonts import TTFontFile
+        with metrics.phase("pdf.font_parse"):
+            ttf = TTFontFile()
+            ttf.getMetrics(path)
+        font = {
+            "name": re.sub(r"[ ()]", "", ttf.fullName),
+            "type": "TTF",
+            "desc": {
+                "Ascent": int(round(ttf.ascent)), "Descent": int(round(ttf.descent)),
+                "CapHeight": int(round(ttf.capHeight)), "Flags": ttf.flags,
+                "FontBBox": "[%d %d %d %d]" % tuple(int(round(value)) for value in ttf.bbox),
+                "ItalicAngle": int(ttf.italicAngle), "StemV": int(round(ttf.stemV)),
+                "MissingWidth": int(round(ttf.defaultWidth)),
+            },
+            "up": round(ttf.underlinePosition),
+            "ut": round(ttf.underlineThickness),
+            "cw": ttf.charWidths,
+            "ttffile": path,
+        }
+        with self.lock:
+            self.parses += 1
+            return self.fonts.setdefault(path, font)
+
+    def subset(self, path, codes):
+        """FontSubset with glyphs for every block of the code points in codes"""
+        font = self.font(path)
+        blocks = frozenset(code // self.BLOCK_SIZE for code in set(codes) if 0 < code < 65536)
+        key = (font["ttffile"], blocks)
+        with self.lock:
+            subset = self.subsets.get(key)
+            if subset is not None:
+                self.subsets.move_to_end(key)
+                self.hits += 1
+                return subset
+            self.misses += 1
+        char_widths = font["cw"]
+        block_codes = [code for block in sorted(blocks)
+                       for code in range(max(1, block * self.BLOCK_SIZE), (block + 1) * self.BLOCK_SIZE)
+                       if char_widths[code]]
+        from fpdf.ttfonts import TTFontFile
+        with metrics.phase("pdf.font_subset"):
+            ttf = TTFontFile()
+            font_stream = ttf.makeSubset(font["ttffile"], block_codes)
+            subset = FontSubset(font, blocks, block_codes, font_stream, ttf.codeToGlyph)
+        with self.lock:
+            self.subsets[key] = subset
+            while len(self.subsets) > self.max_subsets:
+                self.subsets.popitem(last=False)
+        return subset
+
+    def stats(self):
+        with self.lock:
+            return {"fonts": len(self.fonts), "parses": self.parses, "subsets": len(self.subsets),
+                    "hits": self.hits, "misses": self.misses}
+
+FONT_REGISTRY = FontRegistry()
+
+# Key of the TrueType font in the documents pdf_classes()'s UnicodePDF creates
+UNICODE_FONT_KEY = "letter"
+
+@lru_cache(maxsize=None)
+def pdf_classes():
+    """(FPDF, UnicodePDF), importing fpdf on the first PDF render rather than with this module"""
+    from fpdf import FPDF
+
+    class UnicodePDF(FPDF):
+        """FPDF document drawn in one TrueType font from FONT_REGISTRY, embedded as a cached subset"""
+
+        def __init__(self, font_file):
+            super().__init__()
+            self.font_file = font_file
+            font = FONT_REGISTRY.font(font_file)
+            self.fonts[UNICODE_FONT_KEY] = dict(font, i=1, fontkey=UNICODE_FONT_KEY, subset=[])
+
+        def _putfonts(self):
+            font = self.fonts[UNICODE_FONT_KEY]
+            subset = FONT_REGISTRY.subset(self.font_file, font["subset"])
+            font["n"] = self.n + 1
+            for body in subset.objects(range(self.n + 1, self.n + 8)):
+                self._newobj()
+                self._out(body.decode("latin1"))
+                self._out("endobj")
+
+    return FPDF, UnicodePDF
+
+class GlyphWidths(dict):
+    """Character widths of a TrueType font, scaled and filled in as characters are first measured"""
+
+    def __init__(self, char_widths, missing_width, scale):
+        super().__init__()
+        self.char_widths = char_widths
+        self.missing_width = missing_width
+        self.scale = scale
+
+    def __missing__(self, char):
+        code = ord(char)
+        width = self.char_widths[code] if code < 65536 else 0
+        # Characters without a glyph are measured like the font's missing glyph
+        width = self[char] = (0 if width == 65535 else width or self.missing_width) * self.scale
+        return width
+
+class TextLayout:
+    """Wraps text by measured glyph width and splits the lines into pages.
+
+    Glyph widths come from the fpdf core font metrics, or from font_file
+    when a TrueType font is used, and are converted to millimetres once per
+    (font, size); all sizes are in millimetres on A4.
+    """
+    WORD_CACHE_SIZE = 50000
+    _instances = {}
+
+    def __init__(self, font_family="Arial", font_size=12, page_width=210, page_height=297,
+                 margin_left=10, margin_right=10, margin_top=10, margin_bottom=20, line_height=10, font_file=None):
+        scale = font_size / 1000 / (72 / 25.4)
+        if font_file:
+            font = FONT_REGISTRY.font(font_file)
+            missing_width = font["desc"]["MissingWidth"]
+            widest = max(missing_width, max(width for width in font["cw"] if width != 65535)) * scale
+            self.widths = GlyphWidths(font["cw"], missing_width, scale)
+        else:
+            from fpdf.fonts import fpdf_charwidths
+            metrics = fpdf_charwidths[CORE_FONT_METRICS[font_family.lower()]]
+            # Characters outside the metrics table are measured like the widest glyph
+            widest = max(metrics.values()) * scale
+            self.widths = defaultdict(lambda: widest, {char: width * scale for char, width in metrics.items()})
+        self.widest = widest
+        self.space_width = self.widths[' ']
+        self.word_widths = {}
+        self.margin_left = margin_left
+        self.margin_top = margin_top
+        self.line_height = line_height
+        self.max_width = page_width - margin_left - margin_right
+        self.lines_per_page = max(1, int((page_height - margin_top - margin_bottom) // line_height))
+        # Same baseline position FPDF.cell uses for a vertically centred line
+        self.baseline_offset = line_height / 2 + 0.3 * font_size * 25.4 / 72
+
+    @classmethod
+    def for_font(cls, font_family, font_size, font_file=None):
+        """Shared layout for a font, so width tables are built once per process"""
+        key = (font_family.lower(), font_size, font_file)
+        text_layout = cls._instances.get(key)
+        if text_layout is None:
+            text_layout = cls._instances[key] = cls(font_family, font_size, font_file=font_file)
+        return text_layout
+
+    def measure(self, text):
+        """Width of text in millimetres"""
+        return sum(map(self.widths.__getitem__, text))
+
+    def wrap(self, paragraph):
+        """Break one paragraph into lines no wider than max_width in a single pass"""
+        max_width = self.max_width
+        if len(paragraph) * self.widest <= max_width:
+            return [paragraph]
+        word_widths = self.word_widths
+        space_width = self.space_width
+        lines = []
+        line_start = 0
+        position = 0
+        width = -space_width
+        for word in paragraph.split(' '):
+            word_width = word_widths.get(word)
+            if word_width is None:
+                word_width = self.measure(word)
+                if len(word_widths) < self.WORD_CACHE_SIZE:
+                    word_widths[word] = word_width
+            if width + space_width + word_width > max_width and position > line_start:
+                lines.append(paragraph[line_start:position - 1])
+                line_start = position
+                width = word_width
+            else:
+                width += space_width + word_width
+            if width > max_width:
+                # A single word wider than the line is broken across lines
+                pieces = self._split_word(word)
+                lines.extend(pieces[:-1])
+                line_start = position + len(word) - len(pieces[-1])
+                width = self.measure(pieces[-1])
+            position += len(word) + 1
+        lines.append(paragraph[line_start:])
+        return lines
+
+    def _split_word(self, word):
+        """Break a word wider than a whole line at character boundaries"""
+        widths = self.widths
+        pieces = []
+        start = 0
+        width = 0.0
+        for index, char in enumerate(word):
+            char_width = widths[char]
+            if width + char_width > self.max_width and index > start:
+                pieces.append(word[start:index])
+                start = index
+                width = 0.0
+            width += char_width
+        pieces.append(word[start:])
+        return pieces
+
+    def paginate(self, text):
+        """Yield pages as lists of wrapped lines; always yields at least one page"""
+        page = []
+        emitted = False
+        lines_per_page = self.lines_per_page
+        for paragraph in text.split('\n'):
+            for line in self.wrap(paragraph):
+                page.append(line)
+                if len(page) == lines_per_page:
+                    yield page
+                    emitted = True
+                    page = []
+        if page or not emitted:
+            yield page
+
+class PDFCache:
+    """Process-wide LRU cache of rendered PDFs, keyed by a hash of content and render options"""
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(letter_content, **options):
+        """Content address for a letter rendered with the given options"""
+        digest = hashlib.sha256(letter_content.encode('utf-8'))
+        for name in sorted(options):
+            digest.update(f"\0{name}={options[name]!r}".encode('utf-8'))
+        return digest.hexdigest()
+
+    def get(self, key):
+        """Return cached PDF bytes or None, marking the entry as recently used"""
+        with self.lock:
+            pdf_bytes = self.entries.get(key)
+            if pdf_bytes is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return pdf_bytes
+
+    def put(self, key, pdf_bytes):
+        """Store PDF bytes, evicting least recently used entries beyond the byte budget"""
+        if len(pdf_bytes) > self.max_bytes:
+            return
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old)
+            self.entries[key] = pdf_bytes
+            self.size += len(pdf_bytes)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    def stats(self):
+        """Snapshot of cache counters"""
+        with self.lock:
+            return {
+                "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "entries": len(self.entries), "bytes": self.size, "max_bytes": self.max_bytes
+            }
+
+class PDFGenerator:
+    def __init__(self, cache=None, font_file=FONT_FILE, shared_cache=None):
+        self.cache = cache
+        self.shared_cache = shared_cache
+        self.font_family = "Arial"
+        self.font_size = 12
+        self.font_file = font_file
+
+    def render_options(self):
+        """Options that change the rendered PDF, part of the cache key"""
+        return {"font_family": self.font_family, "font_size": self.font_size, "font_file": self.font_file}
+
+    def letter_font(self, letter_content):
+        """TrueType font file for a letter, or None to use the core font"""
+        if self.font_file:
+            return self.font_file
+        try:
+            letter_content.encode('latin1')
+            return None
+        except UnicodeEncodeError:
+            return find_unicode_font()
+
+    @metrics.timed("pdf.create_pdf")
+    def create_pdf(self, letter_content, filename="letter.pdf"):
+        """Create PDF from letter content, reusing the cached bytes when available"""
+        if self.cache is None and self.shared_cache is None:
+            return self._render_pdf(letter_content)
+        key = PDFCache.key(letter_content, **self.render_options())
+        pdf_bytes = self.cached_pdf(key)
+        if pdf_bytes is None:
+            pdf_bytes = self._render_pdf(letter_content)
+            self.store_pdf(key, pdf_bytes)
+        return pdf_bytes
+
+    def renderer_version(self):
+        """Version of the shared cache's PDFs, which outlive this process and must not outlive the renderer"""
+        return pdf_renderer_version(self.font_file)
+
+    def cached_pdf(self, key):
+        """PDF bytes under a PDFCache key from cache or else shared_cache, or None"""
+        pdf_bytes = self.cache.get(key) if self.cache is not None else None
+        if pdf_bytes is None and self.shared_cache is not None:
+            version = self.renderer_version()
+            self.shared_cache.use_version("pdf", version)
+            pdf_bytes = self.shared_cache.get("pdf", key, version)
+            if pdf_bytes is not None and self.cache is not None:
+                self.cache.put(key, pdf_bytes)
+        return pdf_bytes
+
+    def store_pdf(self, key, pdf_bytes):
+        """Keep rendered PDF bytes in cache and shared_cache"""
+        if self.cache is not None:
+            self.cache.put(key, pdf_bytes)
+        if self.shared_cache is not None:
+            self.shared_cache.put("pdf", key, self.renderer_version(), pdf_bytes)
+
+    @metrics.timed("pdf.render")
+    def _render_pdf(self, letter_content):
+        """Lay out and serialize one letter"""
+        pdf = self.layout(letter_content, self.letter_font(letter_content))
+        pdf_output = pdf.output(dest='S')
+        return pdf_output.encode('latin1') if isinstance(pdf_output, str) else pdf_output
+
+    def page_streams(self, letter_content):
+        """(compressed content stream of every page, code points drawn, letter_font used), for StreamingPDFWriter"""
+        font_file = self.letter_font(letter_content)
+        pdf = self.layout(letter_content, font_file)
+        streams = [zlib.compress(pdf.pages[n].encode('latin1')) for n in range(1, pdf.page + 1)]
+        codes = frozenset(pdf.fonts[UNICODE_FONT_KEY]["subset"]) if font_file else frozenset()
+        return streams, codes, font_file
+
+    def write_combined_pdf(self, letters, fileobj):
+        """Write many letters as consecutive pages of one PDF, one letter at a time"""
+        writer = StreamingPDFWriter(fileobj, self.font_file)
+        for letter_content in letters:
+            writer.add_page_streams(*self.page_streams(letter_content))
+        writer.close()
+        return writer.page_count
+
+    def write_zip(self, letters, fileobj, name_format="letter_{:05d}.pdf"):
+        """Write one PDF per letter into a ZIP stream, which may be unseekable"""
+        count = 0
+        with zipfile.ZipFile(fileobj, 'w', zipfile.ZIP_DEFLATED) as archive:
+            for count, letter_content in enumerate(letters, start=1):
+                archive.writestr(name_format.format(count), self.create_pdf(letter_content))
+        return count
+
+    @metrics.timed("pdf.layout")
+    def layout(self, letter_content, font_file=None):
+        """Lay out letter content on the pages of a new FPDF document, in font_file if given"""
+        text_layout = TextLayout.for_font(self.font_family, self.font_size, font_file)
+        fpdf_class, unicode_pdf_class = pdf_classes()
+        if font_file:
+            pdf = unicode_pdf_class(font_file)
+            pdf.set_font(UNICODE_FONT_KEY, size=self.font_size)
+        else:
+            pdf = fpdf_class()
+            pdf.set_font(self.font_family, size=self.font_size)
+        pdf.set_auto_page_break(False)
+        x = text_layout.margin_left
+        for page in text_layout.paginate(letter_content):
+            pdf.add_page()
+            y = text_layout.margin_top + text_layout.baseline_offset
+            for line in page:
+                if line:
+                    pdf.text(x, y, line)
+                y += text_layout.line_height
+        return pdf
+
+class RenderQueueFull(Exception):
+    """Raised when PDFRenderPool already has its maximum number of renders waiting"""
+
+class PDFRenderPool:
+    """Renders PDFs on worker threads so the Streamlit script thread never lays out a letter itself.
+
+    Renders are keyed by the same content hash as PDFCache: sessions asking
+    for the same letter share one pending future, and finished PDFs go into
+    the generator's cache. At most max_queue renders wait or run at a time.
+    """
+
+    def __init__(self, generator, workers=2, max_queue=32):
+        self.generator = generator
+        self.workers = workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pdf-render")
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.submitted = 0
+        self.rejected = 0
+        self.failed = 0
+
+    def submit(self, letter_content):
+        """Future of the PDF bytes of letter_content, already resolved if the PDF is cached"""
+        key = PDFCache.key(letter_content, **self.generator.render_options())
+        pdf_bytes = self.generator.cached_pdf(key)
+        if pdf_bytes is not None:
+            future = Future()
+            future.set_result(pdf_bytes)
+            return future
+        with self.lock:
+            future = self.pending.get(key)
+            if future is not None:
+                return future
+            if len(self.pending) >= self.max_queue:
+                self.rejected += 1
+                metrics.increment("pdf.render_rejected")
+                raise RenderQueueFull(f"{self.max_queue} PDFs are already being rendered")
+            future = self.pending[key] = self.executor.submit(self._render, key, letter_content, time.perf_counter())
+            self.submitted += 1
+        future.add_done_callback(lambda done: self._finished(key))
+        return future
+
+    def _render(self, key, letter_content, submitted):
+        if metrics.ENABLED:
+            metrics.REGISTRY.observe("pdf.render_queue_wait", time.perf_counter() - submitted)
+        pdf_bytes = self.generator._render_pdf(letter_content)
+        self.generator.store_pdf(key, pdf_bytes)
+        if metrics.ENABLED:
+            metrics.REGISTRY.observe("pdf.render_latency", time.perf_counter() - submitted)
+        return pdf_bytes
+
+    def _finished(self, key):
+        with self.lock:
+            future = self.pending.pop(key)
+            if future.exception() is not None:
+                self.failed += 1
+
+    def stats(self):
+        with self.lock:
+            return {"workers": self.workers, "max_queue": self.max_queue, "pending": len(self.pending),
+                    "submitted": self.submitted, "rejected": self.rejected, "failed": self.failed}
+
+class StreamingPDFWriter:
+    """Writes pages of a single PDF to a file object as soon as they are added.
+
+    Only the byte offset of each object is kept, so memory stays flat no matter
+    how many letters go into the document. Objects 1-3 (page tree, resources
+    and the Helvetica font that FPDF maps Arial to) are written on close.
+    With a font_file, object 3 is instead that TrueType font, embedded with
+    the glyphs of every code point the pages draw. Without one, pages drawn
+    in a fallback TrueType font get resources of their own, written on close
+    with that font.
+    """
+    PAGE_SIZE = "0 0 595.28 841.89"  # A4 portrait in points, as FPDF uses
+
+    def __init__(self, fileobj, font_file=None):
+        self.fileobj = fileobj
+        self.font_file = font_file
+        self.codes = set()
+        self.fallback_font = None
+        self.fallback_codes = set()
+        self.fallback_resources = None
+        self.position = 0
+        self.offsets = array('Q', [0, 0, 0])
+        self.pages = array('Q')  # object numbers of the pages, for the page tree
+        self.page_count = 0
+        self._write(b"%PDF-1.3\n")
+
+    def _write(self, data):
+        self.fileobj.write(data)
+        self.position += len(data)
+
+    def _new_object(self):
+        self.offsets.append(self.position)
+        return len(self.offsets)
+
+    def add_page_streams(self, streams, codes=(), font_file=None):
+        """Append pages from compressed content streams drawing codes in font_file (see PDFGenerator.page_streams)"""
+        resources = 2
+        if font_file and font_file != self.font_file:
+            if self.fallback_font is None:
+                self.fallback_font = font_file
+                self.offsets.append(0)  # the fallback resources, written on close
+                self.fallback_resources = len(self.offsets)
+            elif font_file != self.fallback_font:
+                raise ValueError(f"Pages of one PDF can only fall back to one font, not {font_file}")
+            resources = self.fallback_resources
+            self.fallback_codes.update(codes)
+        else:
+            self.codes.update(codes)
+        for stream in streams:
+            page = self._new_object()
+            self.pages.append(page)
+            self._write(
+                f"{page} 0 obj\n<</Type /Page\n/Parent 1 0 R\n/Resources {resources} 0 R\n"
+                f"/Contents {page + 1} 0 R>>\nendobj\n".encode()
+            )
+            self._new_object()
+            self._write(f"{page + 1} 0 obj\n<</Filter /FlateDecode /Length {len(stream)}>>\nstream\n".encode())
+            self._write(stream)
+            self._write(b"\nendstream\nendobj\n")
+            self.page_count += 1
+
+    def close(self):
+        """Write the page tree, shared resources, xref table and trailer"""
+        self.offsets[0] = self.position
+        self._write(b"1 0 obj\n<</Type /Pages\n/Kids [")
+        for start in range(0, self.page_count, 1000):
+            self._write("".join(f"{number} 0 R " for number in self.pages[start:start + 1000]).encode())
+        self._write(f"]\n/Count {self.page_count}\n/MediaBox [{self.PAGE_SIZE}]\n>>\nendobj\n".encode())
+        self.offsets[1] = self.position
+        self._write_resources(2, 3)
+        self.offsets[2] = self.position
+        if self.font_file:
+            self._write_font(3, self.font_file, self.codes)
+        else:
+            self._write(b"3 0 obj\n<</Type /Font\n/BaseFont /Helvetica\n/Subtype /Type1\n/Encoding /WinAnsiEncoding\n>>\nendobj\n")
+        if self.fallback_font:
+            self.offsets[self.fallback_resources - 1] = self.position
+            font = len(self.offsets) + 1
+            self._write_resources(self.fallback_resources, font)
+            self._new_object()
+            self._write_font(font, self.fallback_font, self.fallback_codes)
+        info = self._new_object()
+        self._write(
+            f"{info} 0 obj\n<</Producer (Smart Letter Generator)\n"
+            f"/CreationDate (D:{datetime.now().strftime('%Y%m%d%H%M%S')})>>\nendobj\n".encode()
+        )
+        catalog = self._new_object()
+        self._write(f"{catalog} 0 obj\n<</Type /Catalog\n/Pages 1 0 R>>\nendobj\n".encode())
+        xref = self.position
+        self._write(f"xref\n0 {len(self.offsets) + 1}\n0000000000 65535 f \n".encode())
+        for start in range(0, len(self.offsets), 1000):
+            self._write("".join(f"{offset:010d} 00000 n \n" for offset in self.offsets[start:start + 1000]).encode())
+        self._write(
+            f"trailer\n<</Size {len(self.offsets) + 1}\n/Root {catalog} 0 R\n/Info {info} 0 R>>\n"
+            f"startxref\n{xref}\n%%EOF\n".encode()
+        )
+
+    def _write_resources(self, number, font):
+        self._write(f"{number} 0 obj\n<</ProcSet [/PDF /Text /ImageB /ImageC /ImageI]\n/Font <<\n/F1 {font} 0 R\n>>\n>>"
+                    f"\nendobj\n".encode())
+
+    def _write_font(self, number, font_file, codes):
+        """Write a TrueType font as object number, already at this offset, followed by the six objects it refers to"""
+        first = len(self.offsets) + 1
+        numbers = [number] + list(range(first, first + 6))
+        for object_number, body in zip(numbers, FONT_REGISTRY.subset(font_file, codes).objects(numbers)):
+            if object_number != number:
+                self._new_object()
+            self._write(f"{object_number} 0 obj\n".encode() + body + b"\nendobj\n")
+
+class FileLock:
+    """Exclusive inter-process lock held on a sidecar lock file"""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+b')
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:  # LK_LOCK gives up after ten one-second retries
+                    continue
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if fcntl is not None:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
+
+def atomic_write_json(path, data):
+    """Write JSON to a temp file in the same directory, fsync it and rename it over path"""
+    atomic_write_bytes(path, json.dumps(data).encode("utf-8"))
+
+def atomic_write_bytes(path, data):
+    """Write bytes to a temp file in the same directory, fsync it and rename it over path"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+    try:
+        if os.path.exists(path):
+            os.chmod(temp_path, os.stat(path).st_mode & 0o777)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+TERM_PATTERN = re.compile(r"\w+")
+TEMPLATE_SEARCH_FIELDS = ("type", "style", "content")
+TEMPLATE_PAGE_SIZE = 20  # saved templates listed per sidebar page
+
+def search_terms(text):
+    """Lower-cased word terms of text, in order, without duplicates"""
+    return list(dict.fromkeys(TERM_PATTERN.findall(text.lower())))
+
+def template_terms(template_name, template):
+    """Terms a saved template is indexed under: its name, letter type, style and content"""
+    text = " ".join([template_name] + [str(template.get(field) or "") for field in TEMPLATE_SEARCH_FIELDS])
+    return search_terms(text)
+
+class TemplateIndex:
+    """Inverted index over one user's saved templates, updated as templates change.
+
+    Each query word matches any term starting with it, and a template must
+    match every word. The terms are kept sorted so a prefix is a bisect
+    range, and the cost of a search depends on the number of matches rather
+    than on the number of templates.
+    """
+
+    def __init__(self, templates=None):
+        self.postings = {}   # term -> names of templates containing it
+        self.terms = []      # sorted keys of postings
+        self.names = []      # sorted template names
+        self.doc_terms = {}  # name -> its terms, for removal
+        self.signatures = {}  # name -> signature given to add, to tell which templates changed since
+        self.synced = None   # the templates dict UserManager last brought this index up to date with
+        self.lock = threading.Lock()
+        for name, template in (templates or {}).items():
+            self.add(name, template)
+
+    def add(self, name, template, signature=None):
+        """Index template under name, replacing any template of that name"""
+        self.remove(name)
+        insort(self.names, name)
+        terms = template_terms(name, template)
+        self.doc_terms[name] = terms
+        self.signatures[name] = signature
+        for term in terms:
+            names = self.postings.get(term)
+            if names is None:
+                names = self.postings[term] = set()
+                insort(self.terms, term)
+            names.add(name)
+
+    def remove(self, name):
+        """Drop name from the index; only its own terms are touched"""
+        terms = self.doc_terms.pop(name, None)
+        if terms is None:
+            return
+        del self.signatures[name]
+        for term in terms:
+            names = self.postings[term]
+            names.discard(name)
+            if not names:
+                del self.postings[term]
+                del self.terms[bisect_left(self.terms, term)]
+        del self.names[bisect_left(self.names, name)]
+
+    def prefix_matches(self, prefix):
+        """Names of templates with a term starting with prefix"""
+        start = bisect_left(self.terms, prefix)
+        matches = set()
+        for term in self.terms[start:bisect_left(self.terms, prefix + "\U0010ffff", start)]:
+            matches |= self.postings[term]
+        return matches
+
+    def search(self, query, page=0, page_size=20):
+        """(names on the page, total matches), with names in sorted order"""
+        words = search_terms(query)
+        start = page * page_size
+        if not words:
+            return self.names[start:start + page_size], len(self.names)
+        matches = None
+        for word in sorted(words, key=len, reverse=True):  # longer prefixes are more selective
+            found = self.prefix_matches(word)
+            matches = found if matches is None else matches & found
+            if not matches:
+                return [], 0
+        return sorted(matches)[start:start + page_size], len(matches)
+
+class UserManager:
+    """Users and their saved templates (user_records), stored in a JSON file with letter bodies in blob_dir.
+
+    Changes are written under an inter-process file lock to a copy of users, which then replaces it.
+    """
+
+    def __init__(self, users_file="users.json", write_behind_ms=None, blob_dir=None, max_template_indexes=1000):
+        self.users_file = users_file
+        self.lock_file = users_file + ".lock"
+        self.blob_dir = blob_dir or users_file + ".blobs"
+        self.blob_owner = os.path.basename(users_file) if blob_dir else None
+        self.write_behind_ms = write_behind_ms
+        self.pending = []
+        self.pending_lock = threading.Lock()
+        self.flush_timer = None
+        self.write_lock = threading.RLock()
+        self.template_indexes = OrderedDict()  # username -> TemplateIndex, least recently searched first
+        self.max_template_indexes = max_template_indexes
+        self.index_lock = threading.Lock()
+        self.load_users()
+    
+    @metrics.timed("users.load")
+    def load_users(self):
+        """Load users from file, handling empty or invalid JSON"""
+        with self.write_lock:
+            signature = self._file_signature()
+            try:
+                users = self._read_users()
+            except ValueError:
+                users = {}
+                signature = None  # never mistake this empty store for the file's contents in _commit
+            with self.pending_lock:
+                for change in self.pending:  # keep deferred changes that are not on disk yet
+                    change(users)
+            self.users = users
+            self.signature = signature
+    
+    def refresh(self):
+        """Reload only if the file changed since this instance last read or wrote it"""
+        if self._file_signature() == self.signature:
+            return False
+        metrics.increment("users.reload")
+        self.load_users()
+        return True
+    
+    def _file_signature(self):
+        """(mtime, size) of the users file, or None if it does not exist"""
+        try:
+            stat = os.stat(self.users_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def _read_users(self):
+        """Parse the users file into records, through SHARED_CACHE if set; ValueError if it is not valid JSON"""
+        if not os.path.exists(self.users_file):
+            return {}
+        try:
+            with open(self.users_file, 'r') as f:
+                if SHARED_CACHE is not None:
+                    stat = os.fstat(f.fileno())
+                    shared_key = os.path.abspath(self.users_file)
+                    version = f"{stat.st_dev}:{stat.st_ino}:{stat.st_mtime_ns}:{stat.st_size}"
+                    cached = SHARED_CACHE.get("users", shared_key, version)
+                    if cached is not None:
+                        with gc_paused():
+                            return pickle.loads(cached)
+                content = f.read().strip()
+        except IOError:
+            return {}
+        users = users_from_json(json.loads(content)) if content else {}
+        if SHARED_CACHE is not None:
+            SHARED_CACHE.put("users", shared_key, version, pickle.dumps(users, pickle.HIGHEST_PROTOCOL))
+        return users
+    
+    def save_users(self):
+        """Atomically replace the file with the users held in memory"""
+        users = dict(self.users)
+        def replace_all(latest):
+            latest.clear()
+            latest.update(users)
+        self._commit(replace_all)
+    
+    @metrics.timed("users.write")
+    def _commit(self, change=None):
+        """Apply pending changes and change to the latest file contents and write them back.
+
+        Raises ValueError rather than write over a file that cannot be parsed.
+        """
+        with self.write_lock:
+            with self.pending_lock:
+                changes = self.pending
+                deferred = bool(changes)
+                self.pending = []
+                if self.flush_timer is not None:
+                    self.flush_timer.cancel()
+                    self.flush_timer = None
+                    atexit.unregister(self.flush)
+            if change is not None:
+                changes.append(change)
+            with FileLock(self.lock_file):
+                unchanged = self._file_signature() == self.signature
+                users = dict(self.users) if unchanged and not deferred else self._read_users()
+                referenced = self._content_refs(users)
+                results = [apply(users) for apply in changes]
+                self._store_inline_contents(users)
+                atomic_write_json(self.users_file, users_to_json(users))
+                self.users = users
+                self.signature = self._file_signature()
+                remaining = self._content_refs(users)
+                for digest in referenced.keys() - remaining.keys():
+                    self._delete_blob(digest)
+        return results[-1] if results else None
+    
+    @staticmethod
+    def _content_refs(users):
+        """Number of saved templates referring to each content hash"""
+        refs = Counter()
+        for user in users.values():
+            for template in (user.templates or {}).values():
+                if template.content_ref is not None:
+                    refs[template.content_ref] += 1
+        return refs
+    
+    def _store_inline_contents(self, users):
+        """Move content still held inline, as written before the blob store, into blobs"""
+        for username, user in users.items():
+            inline = [name for name, template in (user.templates or {}).items() if template.content is not None]
+            if not inline:
+                continue
+            templates = self._own_user(users, username).templates
+            for name in inline:
+                template = templates[name] = copy.copy(templates[name])
+                template.content_ref = sys.intern(self._store_blob(template.content))
+                template.content = None
+    
+    def _blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest[:2], digest)
+    
+    def _store_blob(self, content):
+        """Write content compressed under its SHA-256 unless already stored, returning the hash"""
+        raw = content.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        path = self._blob_path(digest)
+        if self.blob_owner is None:
+            self._write_blob(path, raw)
+            return digest
+        claim = os.path.join(path + ".refs", self.blob_owner)
+        if os.path.exists(claim):  # no other manager deletes a blob this one still claims
+            return digest
+        os.makedirs(self.blob_dir, exist_ok=True)
+        with FileLock(os.path.join(self.blob_dir, "blobs.lock")):
+            self._write_blob(path, raw)
+            os.makedirs(os.path.dirname(claim), exist_ok=True)
+            open(claim, "ab").close()
+        return digest
+    
+    @staticmethod
+    def _write_blob(path, raw):
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            atomic_write_bytes(path, zlib.compress(raw, 9))
+            metrics.increment("users.blob_write")
+    
+    def _load_blob(self, digest):
+        with open(self._blob_path(digest), "rb") as f:
+            return zlib.decompress(f.read()).decode("utf-8")
+    
+    def _delete_blob(self, digest):
+        """Delete a blob this manager no longer refers to, unless managers sharing blob_dir still do"""
+        path = self._blob_path(digest)
+        if self.blob_owner is None:
+            self._unlink_blob(path)
+            return
+        with FileLock(os.path.join(self.blob_dir, "blobs.lock")):
+            claims = path + ".refs"
+            try:
+                os.unlink(os.path.join(claims, self.blob_owner))
+            except FileNotFoundError:
+                pass
+            try:
+                os.rmdir(claims)
+            except FileNotFoundError:
+                pass
+            except OSError:  # not empty: other managers still claim it
+                return
+            self._unlink_blob(path)
+    
+    @staticmethod
+    def _unlink_blob(path):
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            pass
+    
+    def _expand_template(self, template):
+        """A stored template in the JSON shape, with its content read back from the blob store"""
+        expanded = template.to_json()
+        if "content_ref" in expanded:
+            expanded["content"] = self._load_blob(expanded.pop("content_ref"))
+        return expanded
+    
+    @staticmethod
+    def _templates_of(users, username):
+        """{name: SavedTemplate} of a user, empty if the user does not exist"""
+        user = users.get(username)
+        return (user.templates if user is not None else None) or {}
+    
+    @staticmethod
+    def _own_user(users, username):
+        """Replace a user in users with a copy holding its own templates dict and return it, or None"""
+        user = users.get(username)
+        if user is None:
+            return None
+        user = users[username] = copy.copy(user)
+        if user.templates is not None:
+            user.templates = dict(user.templates)
+        return user
+    
+    @metrics.timed("users.defer")
+    def _defer(self, change):
+        """Apply change in memory now and schedule it to be written with the next flush"""
+        with self.write_lock:
+            users = dict(self.users)
+            result = change(users)
+            self.users = users
+            with self.pending_lock:
+                self.pending.append(change)
+                if self.flush_timer is None:
+                    self.flush_timer = threading.Timer(self.write_behind_ms / 1000, self.flush)
+                    self.flush_timer.daemon = True
+                    self.flush_timer.start()
+                    atexit.register(self.flush)
+        return result
+    
+    def flush(self):
+        """Write any deferred changes immediately"""
+        if self.pending:
+            self._commit()
+    
+    def hash_password(self, password):
+        """Hash password for security"""
+        return hashlib.sha256(password.encode()).hexdigest()
+    
+    @metrics.timed("users.register")
+    def register_user(self, username, password, email, full_name):
+        """Register new user"""
+        if username in self.users:
+            return False, "Username already exists"
+        user = User.from_json({
+            "password": self.hash_password(password),
+            "email": email,
+            "full_name": full_name,
+            "templates": {},
+            "created_at": datetime.now().isoformat()
+        })
+        def add_user(users):
+            if username in users:
+                return False
+            users[username] = user
+            return True
+        try:
+            if not self._commit(add_user):
+                return False, "Username already exists"
+        except (IOError, ValueError) as e:
+            return False, f"Could not save the user: {e}"
+        return True, "User registered successfully"
+    
+    @metrics.timed("users.login")
+    def login_user(self, username, password):
+        """Login user"""
+        if username not in self.users:
+            return False, "Username not found"
+        if self.users[username].password != self.hash_password(password):
+            return False, "Invalid password"
+        return True, ""
+    
+    def get_user_templates(self, username):
+        """Get user's saved templates"""
+        refreshed = False
+        while True:
+            templates = self._templates_of(self.users, username)
+            try:
+                return {name: self._expand_template(template) for name, template in templates.items()}
+            except FileNotFoundError:
+                # A change committed meanwhile, here or in another process, deleted a blob these records
+                # referred to; read the new ones
+                if templates is self._templates_of(self.users, username):
+                    if refreshed or not self.refresh():
+                        raise
+                    refreshed = True
+    
+    def get_user_template(self, username, template_name):
+        """One saved template, or None"""
+        refreshed = False
+        while True:
+            template = self._templates_of(self.users, username).get(template_name)
+            try:
+                return self._expand_template(template) if template is not None else None
+            except FileNotFoundError:
+                if template is self._templates_of(self.users, username).get(template_name):
+                    if refreshed or not self.refresh():
+                        raise
+                    refreshed = True
+    
+    def export_users(self):
+        """All users in the users.json format, with template content inline"""
+        return {
+            username: dict(user.to_json(), templates=self.get_user_templates(username))
+            for username, user in self.users.items()
+        }
+    
+    @metrics.timed("users.search_templates")
+    def search_user_templates(self, username, query="", page=0, page_size=20):
+        """(template names on the page, total matches) for a prefix/keyword query"""
+        with self.index_lock:
+            index = self.template_indexes.get(username)
+            if index is None:
+                index = self.template_indexes[username] = TemplateIndex()
+                while len(self.template_indexes) > self.max_template_indexes:
+                    self.template_indexes.popitem(last=False)
+            else:
+                self.template_indexes.move_to_end(username)
+        with index.lock:
+            self._sync_index(index, username)
+            return index.search(query, page, page_size)
+    
+    def _sync_index(self, index, username):
+        """Bring a user's TemplateIndex up to date after a reload, reading back only templates that changed"""
+        while True:
+            templates = self._templates_of(self.users, username)
+            if index.synced is templates:
+                return
+            for name in [name for name in index.signatures if name not in templates]:
+                index.remove(name)
+            try:
+                for name, template in templates.items():
+                    signature = self._index_signature(template)
+                    if index.signatures.get(name) != signature:
+                        index.add(name, self._expand_template(template), signature)
+            except FileNotFoundError:
+                # A change committed meanwhile deleted a blob these records referred to; sync with the new ones
+                if templates is self._templates_of(self.users, username):
+                    raise
+                continue
+            index.synced = templates
+            return
+    
+    @staticmethod
+    def _index_signature(template):
+        return template.type, template.style, template.content_ref, template.content
+    
+    def _update_index(self, username, before, after, template_name, template=None, template_data=None):
+        """Apply a save (template given) or delete of template_name, which turned before into after, to the index.
+
+        Only an index current with before is changed; any other is brought up to date by _sync_index.
+        """
+        index = self.template_indexes.get(username)
+        if index is None:
+            return
+        with index.lock:
+            if index.synced is not before:
+                return
+            if template is None:
+                index.remove(template_name)
+            else:
+                index.add(template_name, template_data, self._index_signature(template))
+            index.synced = after
+    
+    @metrics.timed("users.save_template")
+    def save_user_template(self, username, template_name, template_data):
+        """Save user template, handling non-serializable objects"""
+        if username in self.users:
+            serialized_data = self.serialize_template_data(template_data)
+            content = serialized_data.get("content")
+            stored = SavedTemplate.from_json(
+                {key: value for key, value in serialized_data.items() if key != "content" or not isinstance(content, str)}
+            )
+            
+            def put_template(users):
+                before = self._templates_of(users, username)
+                user = self._own_user(users, username)
+                if user is None:
+                    return False
+                if isinstance(content, str):
+                    # (Re)written on every apply: under the lock it may have been collected since
+                    stored.content_ref = sys.intern(self._store_blob(content))
+                if user.templates is None:
+                    user.templates = {}
+                user.templates[template_name] = stored
+                self._update_index(username, before, user.templates, template_name, stored, serialized_data)
+                return True
+            try:
+                if self.write_behind_ms:
+                    saved = self._defer(put_template)
+                else:
+                    saved = self._commit(put_template)
+            except (IOError, TypeError, ValueError):
+                return False  # Prevent data corruption on save failure
+            return saved
+        return False
+    
+    @metrics.timed("users.delete_template")
+    def delete_user_template(self, username, template_name):
+        """Delete one of the user's saved templates, returning (success, message)"""
+        if template_name not in self._templates_of(self.users, username):
+            return False, "Template not found"
+        def remove_template(users):
+            before = self._templates_of(users, username)
+            if template_name not in before:
+                return False
+            after = self._own_user(users, username).templates
+            del after[template_name]
+            self._update_index(username, before, after, template_name)
+            return True
+        try:
+            if self.write_behind_ms:
+                removed = self._defer(remove_template)
+            else:
+                removed = self._commit(remove_template)
+        except (IOError, ValueError) as e:
+            return False, f"Could not delete the template: {e}"
+        return (True, "Template deleted") if removed else (False, "Template not found")
+    
+    @staticmethod
+    def serialize_template_data(template_data):
+        """Deep copy of template_data with dates converted to ISO strings"""
+        # Convert non-serializable objects in template_data
+        def serialize_data(obj):
+            if isinstance(obj, date):  # Handle datetime.date
+                return obj.isoformat()
+            return obj
+        
+        return json.loads(json.dumps(template_data, default=serialize_data))
+
+class SQLiteUserManager(UserManager):
+    """UserManager stored in SQLite, writing only the rows a change touches.
+
+    WAL mode lets other sessions read while a write is in progress. Each
+    thread gets its own connection because Streamlit runs sessions on
+    separate threads.
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS users (
+            username TEXT PRIMARY KEY,
+            password TEXT NOT NULL,
+            email TEXT,
+            full_name TEXT,
+            created_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS templates (
+            id INTEGER PRIMARY KEY,
+            username TEXT NOT NULL REFERENCES users(username) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            type TEXT,
+            style TEXT,
+            content TEXT,
+            data TEXT,
+            created_at TEXT,
+            UNIQUE (username, name)
+        );
+        CREATE TABLE IF NOT EXISTS template_terms (
+            username TEXT NOT NULL,
+            term TEXT NOT NULL,
+            name TEXT NOT NULL,
+            PRIMARY KEY (username, term, name)
+        ) WITHOUT ROWID;
+        CREATE INDEX IF NOT EXISTS template_terms_by_name ON template_terms (username, name);
+    """
+    # PRAGMA user_version once template_terms has been filled for existing templates
+    SCHEMA_VERSION = 1
+    USER_COLUMNS = ("password", "email", "full_name", "created_at")
+    TEMPLATE_COLUMNS = ("type", "style", "content", "data", "created_at")
+
+    def __init__(self, db_file="users.db"):
+        self.db_file = db_file
+        self.local = threading.local()
+        self.load_users()
+
+    @property
+    def connection(self):
+        """Connection for the current thread, opened on first use"""
+        connection = getattr(self.local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.db_file, timeout=30)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.execute("PRAGMA foreign_keys=ON")
+            self.local.connection = connection
+        return connection
+
+    @metrics.timed("users.load")
+    def load_users(self):
+        """Create the tables if needed; rows are read on demand"""
+        with self.connection:
+            self.connection.executescript(self.SCHEMA)
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] < self.SCHEMA_VERSION:
+                rows = self.connection.execute(
+                    "SELECT username, name, type, style, content FROM templates"
+                ).fetchall()
+                for username, name, *values in rows:
+                    self._index_template(username, name, dict(zip(TEMPLATE_SEARCH_FIELDS, values)))
+                self.connection.execute(f"PRAGMA user_version = {self.SCHEMA_VERSION}")
+
+    def _index_template(self, username, template_name, template):
+        """Replace the search terms of one template; call inside a transaction"""
+        self.connection.execute(
+            "DELETE FROM template_terms WHERE username = ? AND name = ?", (username, template_name)
+        )
+        self.connection.executemany(
+            "INSERT INTO template_terms (username, term, name) VALUES (?, ?, ?)",
+            ((username, term, template_name) for term in template_terms(template_name, template))
+        )
+
+    def save_users(self):
+        """Nothing to do: every change is committed as it happens"""
+
+    def flush(self):
+        """Nothing to do: every change is committed as it happens"""
+
+    def refresh(self):
+        """Nothing to do: every read goes to the database"""
+        return False
+
+    @metrics.timed("users.register")
+    def register_user(self, username, password, email, full_name):
+        """Register new user"""
+        try:
+            with self.connection:
+                self.connection.execute(
+                    "INSERT INTO users (username, password, email, full_name, created_at) VALUES (?, ?, ?, ?, ?)",
+                    (username, self.hash_password(password), email, full_name, datetime.now().isoformat())
+                )
+        except sqlite3.IntegrityError:
+            return False, "Username already exists"
+        return True, "User registered successfully"
+
+    @metrics.timed("users.login")
+    def login_user(self, username, password):
+        """Login user"""
+        row = self.connection.execute(
+            "SELECT password FROM users WHERE username = ?", (username,)
+        ).fetchone()
+        if row is None:
+            return False, "Username not found"
+        if row[0] != self.hash_password(password):
+            return False, "Invalid password"
+        return True, ""
+
+    def get_user_templates(self, username):
+        """Get user's saved templates, in the order they were first saved"""
+        rows = self.connection.execute(
+            "SELECT name, type, style, content, data, created_at FROM templates WHERE username = ? ORDER BY id",
+            (username,)
+        )
+        return {name: self._template_from_row(values) for name, *values in rows}
+
+    def get_user_template(self, username, template_name):
+        """One saved template, or None"""
+        row = self.connection.execute(
+            "SELECT type, style, content, data, created_at FROM templates WHERE username = ? AND name = ?",
+            (username, template_name)
+        ).fetchone()
+        return self._template_from_row(row) if row is not None else None
+
+    @classmethod
+    def _template_from_row(cls, row):
+        """A template in the users.json shape from its TEMPLATE_COLUMNS values"""
+        template = {column: value for column, value in zip(cls.TEMPLATE_COLUMNS, row) if value is not None}
+        if "data" in template:
+            template["data"] = json.loads(template["data"])
+        return template
+
+    def export_users(self):
+        """All users in the users.json format, with template content inline"""
+        users = {}
+        for username, *values in self.connection.execute(
+            "SELECT username, password, email, full_name, created_at FROM users ORDER BY rowid"
+        ):
+            users[username] = {column: value for column, value in zip(self.USER_COLUMNS, values) if value is not None}
+            users[username]["templates"] = {}
+        for username, name, *values in self.connection.execute(
+            "SELECT username, name, type, style, content, data, created_at FROM templates ORDER BY id"
+        ):
+            users[username]["templates"][name] = self._template_from_row(values)
+        return users
+
+    @metrics.timed("users.search_templates")
+    def search_user_templates(self, username, query="", page=0, page_size=20):
+        """(template names on the page, total matches) for a prefix/keyword query"""
+        words = search_terms(query)
+        if words:
+            # One range scan of the (username, term) key per word, intersected
+            matching = " INTERSECT ".join(
+                ["SELECT name FROM template_terms WHERE username = ? AND term >= ? AND term < ?"] * len(words)
+            )
+            params = [value for word in words for value in (username, word, word + "\U0010ffff")]
+        else:
+            matching = "SELECT name FROM templates WHERE username = ?"
+            params = [username]
+        total = self.connection.execute(f"SELECT COUNT(*) FROM ({matching})", params).fetchone()[0]
+        rows = self.connection.execute(
+            f"SELECT name FROM ({matching}) ORDER BY name LIMIT ? OFFSET ?", params + [page_size, page * page_size]
+        )
+        return [name for (name,) in rows], total
+
+    @metrics.timed("users.save_template")
+    def save_user_template(self, username, template_name, template_data):
+        """Save user template as a single row, replacing one with the same name"""
+        serialized_data = self.serialize_template_data(template_data)
+        if "data" in serialized_data:
+            serialized_data["data"] = json.dumps(serialized_data["data"])
+        values = [serialized_data.get(column) for column in self.TEMPLATE_COLUMNS]
+        try:
+            with self.connection:
+                cursor = self.connection.execute(
+                    "INSERT INTO templates (username, name, type, style, content, data, created_at) "
+                    "SELECT ?, ?, ?, ?, ?, ?, ? WHERE EXISTS (SELECT 1 FROM users WHERE username = ?) "
+                    "ON CONFLICT (username, name) DO UPDATE SET type = excluded.type, style = excluded.style, "
+                    "content = excluded.content, data = excluded.data, created_at = excluded.created_at",
+                    (username, template_name, *values, username)
+                )
+                if cursor.rowcount > 0:
+                    self._index_template(username, template_name, serialized_data)
+        except sqlite3.Error:
+            return False
+        return cursor.rowcount > 0
+
+    @metrics.timed("users.delete_template")
+    def delete_user_template(self, username, template_name):
+        """Delete one of the user's saved templates, returning (success, message)"""
+        with self.connection:
+            cursor = self.connection.execute(
+                "DELETE FROM templates WHERE username = ? AND name = ?", (username, template_name)
+            )
+            self.connection.execute(
+                "DELETE FROM template_terms WHERE username = ? AND name = ?", (username, template_name)
+            )
+        return (True, "Template deleted") if cursor.rowcount > 0 else (False, "Template not found")
+
+    def import_users(self, users):
+        """Bulk insert users in the users.json format in one transaction"""
+        with self.connection:
+            self.connection.executemany(
+                "INSERT INTO users (username, password, email, full_name, created_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (username) DO UPDATE SET password = excluded.password, email = excluded.email, "
+                "full_name = excluded.full_name, created_at = excluded.created_at",
+                ((username, user["password"], user.get("email"), user.get("full_name"), user.get("created_at"))
+                 for username, user in users.items())
+            )
+            for username, user in users.items():
+                for template_name, template in user.get("templates", {}).items():
+                    template = dict(template)
+                    if "data" in template:
+                        template["data"] = json.dumps(template["data"])
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO templates (username, name, type, style, content, data, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (username, template_name, *(template.get(column) for column in self.TEMPLATE_COLUMNS))
+                    )
+                    self._index_template(username, template_name, template)
+
+class ShardedUserManager(UserManager):
+    """UserManager split into hash-bucketed shard files in one directory, sharing one blob store.
+
+    manifest.json keeps the shard count the directory was created with.
+    """
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory="users", shard_count=256, write_behind_ms=None):
+        self.directory = directory
+        self.write_behind_ms = write_behind_ms
+        self.shards = {}
+        self.shards_lock = threading.Lock()
+        self.shard_count = self._load_manifest(shard_count)
+
+    def _load_manifest(self, shard_count):
+        """Shard count from the manifest, creating the directory and manifest on first use"""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, self.MANIFEST)
+        with FileLock(path + ".lock"):
+            if not os.path.exists(path):
+                atomic_write_json(path, {"version": 1, "shard_count": shard_count})
+            with open(path) as f:
+                return json.load(f)["shard_count"]
+
+    def shard_index(self, username):
+        digest = hashlib.blake2b(username.encode("utf-8"), digest_size=8).digest()
+        return int.from_bytes(digest, "big") % self.shard_count
+
+    def _shard_at(self, index):
+        shard = self.shards.get(index)
+        if shard is None:
+            with self.shards_lock:
+                shard = self.shards.get(index)
+                if shard is None:
+                    width = len(f"{self.shard_count - 1:x}")
+                    path = os.path.join(self.directory, f"shard-{index:0{width}x}.json")
+                    shard = self.shards[index] = UserManager(path, self.write_behind_ms,
+                                                             os.path.join(self.directory, "blobs"))
+                    metrics.increment("users.shard_load")
+        return shard
+
+    def shard(self, username):
+        """The UserManager holding username, reading its file on first use"""
+        return self._shard_at(self.shard_index(username))
+
+    def load_users(self):
+        """Nothing to do: shards are read on first use"""
+
+    def refresh(self):
+        """Reload the shards read so far that another process has changed"""
+        return any([shard.refresh() for shard in list(self.shards.values())])
+
+    def save_users(self):
+        for shard in list(self.shards.values()):
+            shard.save_users()
+
+    def flush(self):
+        for shard in list(self.shards.values()):
+            shard.flush()
+
+    def register_user(self, username, password, email, full_name):
+        return self.shard(username).register_user(username, password, email, full_name)
+
+    def login_user(self, username, password):
+        return self.shard(username).login_user(username, password)
+
+    def get_user_templates(self, username):
+        return self.shard(username).get_user_templates(username)
+
+    def get_user_template(self, username, template_name):
+        return self.shard(username).get_user_template(username, template_name)
+
+    def search_user_templates(self, username, query="", page=0, page_size=20):
+        return self.shard(username).search_user_templates(username, query, page, page_size)
+
+    def save_user_template(self, username, template_name, template_data):
+        return self.shard(username).save_user_template(username, template_name, template_data)
+
+    def delete_user_template(self, username, template_name):
+        return self.shard(username).delete_user_template(username, template_name)
+
+    def export_users(self):
+        """All users of every shard in the users.json format, with template content inline"""
+        users = {}
+        for index in range(self.shard_count):
+            users.update(self._shard_at(index).export_users())
+        return users
+
+    def import_users(self, users):
+        """Insert or replace users in the users.json format, writing each shard once"""
+        groups = defaultdict(dict)
+        for username, user in users.items():
+            groups[self.shard_index(username)][username] = user
+        for index, group in groups.items():
+            records = users_from_json(group)
+            self._shard_at(index)._commit(lambda latest, records=records: latest.update(records))
+
+def migrate_users_to_sqlite(users_file="users.json", db_file="users.db"):
+    """One-shot copy of a users.json store into SQLite, returning (users, templates) counts"""
+    users = UserManager(users_file).export_users()
+    SQLiteUserManager(db_file).import_users(users)
+    return len(users), sum(len(user.get("templates", {})) for user in users.values())
+
+def migrate_users_to_shards(users_file="users.json", directory="users", shard_count=256):
+    """One-shot copy of a users.json store into a sharded store, returning (users, templates) counts"""
+    users = UserManager(users_file).export_users()
+    ShardedUserManager(directory, shard_count).import_users(users)
+    return len(users), sum(len(user.get("templates", {})) for user in users.values())
+
+def create_user_manager():
+    """UserManager for the backend selected by the USER_STORE environment variable"""
+    store = os.environ.get("USER_STORE", "json")
+    if store == "sqlite":
+        return SQLiteUserManager(os.environ.get("USER_DB_FILE", "users.db"))
+    write_behind_ms = os.environ.get("USER_WRITE_BEHIND_MS")
+    write_behind_ms = int(write_behind_ms) if write_behind_ms else None
+    if store == "sharded":
+        return ShardedUserManager(os.environ.get("USER_SHARD_DIR", "users"),
+                                  int(os.environ.get("USER_SHARD_COUNT", 256)), write_behind_ms)
+    return UserManager(write_behind_ms=write_behind_ms)
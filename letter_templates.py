@@ -0,0 +1,368 @@
+"""Letter types, their fields and style templates, loaded from TOML files.
+
+Each *.toml file in LETTER_TEMPLATE_DIR (default: the templates directory
+next to this module) defines one letter type:
+
+    letter_type = "Application for Leave"
+
+    [[fields]]                  # in form order; column is 1 or 2
+    name = "from_date"
+    label = "From Date*"
+    key = "leave_from"          # Streamlit widget key
+    type = "date"               # "text" (default), "date" or "email"
+    required = true
+    widget = "textarea"         # optional: "text", "textarea" or "date"
+    max_length = 200            # optional, defaults to MAX_LENGTHS of the widget
+    after = "start_date"        # date fields only: must not be before this earlier date field
+
+    [computed.closing]          # {@closing}: then if the field is set, else otherwise
+    when = "reason"
+    then = "Reason: {reason}"
+    else = ""
+
+    [styles]                    # "standard" is required and used for unknown styles
+    standard = '''...'''
+
+    [locales.es.computed.closing]   # translations: same tables under locales.<code>
+    ...
+    [locales.es.styles]
+    standard = '''...'''
+
+Each locale also has a catalog in the locales subdirectory with its name and
+date rules, e.g. locales/es.toml:
+
+    locale = "es"
+    name = "Español"
+    date_format = "{day} de {month} de {year}"
+    months = ["enero", ..., "diciembre"]
+
+A style missing from a locale falls back to that locale's standard style, and
+a letter type without a translation, or an unknown locale, renders in
+DEFAULT_LOCALE.
+
+Slot syntax: {date} render date, {field} required field, {field|default}
+field with default when missing, {field:.50} format spec, {@name} computed slot.
+Field values that are dates, as validation leaves date fields, are written
+in the locale's date format like {date}.
+
+Files are compiled once. The directories are checked again at most every
+LETTER_TEMPLATE_RELOAD_INTERVAL seconds (default 2) and only files whose
+mtime or size changed are recompiled; a file that fails to reload keeps its
+previous version. This module is imported, not run as a script, so the
+compiled templates survive Streamlit reruns.
+"""
+import hashlib
+import os
+import threading
+import time
+import tomllib
+from datetime import date
+from string import Formatter
+
+import metrics
+
+TEMPLATE_DIR = os.environ.get(
+    "LETTER_TEMPLATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+)
+RELOAD_INTERVAL = float(os.environ.get("LETTER_TEMPLATE_RELOAD_INTERVAL", "2"))
+DATE_FORMAT = "%B %d, %Y"  # used when DEFAULT_LOCALE has no catalog
+# Part of TemplateRegistry.fingerprint; bump when a change to rendering alters the letters the same files produce
+RENDER_VERSION = 2
+DEFAULT_LOCALE = "en"
+FIELD_TYPES = {"text", "date", "email"}
+WIDGETS = {"text", "textarea", "date"}
+MAX_LENGTHS = {"text": 200, "textarea": 5000, "date": 10}
+
+
+class CompiledTemplate:
+    """Template split once into literal segments and named slot getters"""
+
+    def __init__(self, source, computed=None):
+        self.parts = []
+        self.slots = []
+        for literal, field, spec, conversion in Formatter().parse(source):
+            if literal:
+                self.parts.append(literal)
+            if field is None:
+                continue
+            if conversion:
+                raise ValueError(f"Conversions are not supported in template slot '{field}'")
+            self.slots.append((len(self.parts), self._make_getter(field, spec or "", computed or {})))
+            self.parts.append("")
+
+    @staticmethod
+    def _make_getter(field, spec, computed):
+        """Build the function that fills one slot from the letter data"""
+        if field == "date":
+            return lambda data, date_str: format(date_str, spec)
+        if field.startswith("@"):
+            if field[1:] not in computed:
+                raise ValueError(f"Unknown computed slot '{field}'")
+            compute = computed[field[1:]]
+            return lambda data, date_str: format(compute(data, date_str), spec)
+        if "|" in field:
+            key, default = field.split("|", 1)
+            return lambda data, date_str: format(data.get(key, default), spec)
+        return lambda data, date_str: format(data[field], spec)
+
+    def render(self, data, date_str):
+        """Fill every slot and join the segments"""
+        parts = self.parts[:]
+        for index, getter in self.slots:
+            parts[index] = getter(data, date_str)
+        return "".join(parts)
+
+
+def compile_computed(name, spec):
+    """Function for a [computed.name] table choosing between two templates"""
+    try:
+        when = spec["when"]
+        then = CompiledTemplate(spec["then"])
+        otherwise = CompiledTemplate(spec.get("else", ""))
+    except KeyError as e:
+        raise ValueError(f"computed slot '{name}' needs {e}")
+    return lambda data, date_str: (then if data.get(when) else otherwise).render(data, date_str)
+
+
+def compile_fields(fields, stem):
+    """Field specs keyed by name, with the UI defaults filled in"""
+    compiled = {}
+    for field in fields:
+        name = field.get("name")
+        if not name:
+            raise ValueError("every [[fields]] entry needs a name")
+        field_type = field.get("type", "text")
+        if field_type not in FIELD_TYPES:
+            raise ValueError(f"field '{name}' has unknown type '{field_type}'")
+        widget = field.get("widget", "date" if field_type == "date" else "text")
+        if widget not in WIDGETS:
+            raise ValueError(f"field '{name}' has unknown widget '{widget}'")
+        max_length = field.get("max_length", MAX_LENGTHS[widget])
+        if not isinstance(max_length, int) or max_length < 1:
+            raise ValueError(f"field '{name}' needs a positive integer max_length")
+        after = field.get("after")
+        if after is not None and (field_type != "date" or compiled.get(after, {}).get("type") != "date"):
+            raise ValueError(f"field '{name}' can only come after an earlier date field, not '{after}'")
+        required = bool(field.get("required", False))
+        compiled[name] = {
+            "required": required,
+            "type": field_type,
+            "label": field.get("label", name.replace("_", " ").title() + ("*" if required else "")),
+            "key": field.get("key", f"{stem}_{name}"),
+            "widget": widget,
+            "column": 2 if field.get("column") == 2 else 1,
+            "height": field.get("height"),
+            "max_length": max_length,
+            "after": after,
+        }
+    return compiled
+
+
+def compile_styles(spec, computed):
+    """{style: CompiledTemplate} for the [styles] and [computed] tables of spec"""
+    computed = dict(computed)
+    computed.update((name, compile_computed(name, value)) for name, value in spec.get("computed", {}).items())
+    styles = spec.get("styles", {})
+    if "standard" not in styles:
+        raise ValueError("[styles] must define 'standard'")
+    # Normalize line endings so a CRLF checkout renders the same letters
+    return {
+        style: CompiledTemplate(source.replace("\r\n", "\n"), computed) for style, source in styles.items()
+    }
+
+
+def load_template_file(path):
+    """Parse and compile one letter type file into (letter_type, fields, {(locale, style): CompiledTemplate})"""
+    with open(path, "rb") as f:
+        spec = tomllib.load(f)
+    letter_type = spec.get("letter_type")
+    if not isinstance(letter_type, str) or not letter_type:
+        raise ValueError("letter_type must be a non-empty string")
+    stem = os.path.splitext(os.path.basename(path))[0]
+    fields = compile_fields(spec.get("fields", []), stem)
+    base_computed = {name: compile_computed(name, value) for name, value in spec.get("computed", {}).items()}
+    templates = {}
+    for locale, locale_spec in [(DEFAULT_LOCALE, spec)] + list(spec.get("locales", {}).items()):
+        try:
+            compiled = compile_styles(locale_spec, base_computed)
+        except ValueError as e:
+            if locale == DEFAULT_LOCALE:
+                raise
+            raise ValueError(f"locale '{locale}': {e}")
+        for style, template in compiled.items():
+            templates[(locale, style)] = template
+    return letter_type, fields, templates
+
+
+class LocaleFormat:
+    """Date rules of one locale, compiled once"""
+
+    def __init__(self, locale, name, date_format, months):
+        if len(months) != 12:
+            raise ValueError("months must list the 12 month names")
+        self.locale = locale
+        self.name = name
+        self.date_format = date_format
+        self.months = tuple(months)
+        self.format_date(date(2000, 1, 1))  # fail at load time on a bad date_format
+
+    def format_date(self, value):
+        return self.date_format.format(day=value.day, month=self.months[value.month - 1], year=value.year)
+
+
+def load_locale_file(path):
+    """Parse one locale catalog into a LocaleFormat"""
+    with open(path, "rb") as f:
+        spec = tomllib.load(f)
+    try:
+        return LocaleFormat(spec["locale"], spec.get("name", spec["locale"]), spec["date_format"], spec["months"])
+    except KeyError as e:
+        raise ValueError(f"locale catalog needs {e}")
+    except (IndexError, TypeError) as e:
+        raise ValueError(f"invalid date_format: {e}")
+
+
+class TemplateRegistry:
+    """Compiled templates of every letter type file in a directory, reloaded per file on change.
+
+    fields, styles and locale_codes are updated in place on reload, so
+    modules holding them (LETTER_FIELDS, LETTER_STYLES, LETTER_LOCALES)
+    always see the current definitions. generation increases on every
+    change and is part of render cache keys. fingerprint identifies the
+    loaded files by name, mtime and size, and RENDER_VERSION, so processes
+    on one host that loaded the same files agree on it.
+    """
+
+    def __init__(self, directory=TEMPLATE_DIR, reload_interval=RELOAD_INTERVAL):
+        self.directory = directory
+        self.reload_interval = reload_interval
+        self.locale_directory = os.path.join(directory, "locales")
+        self.files = {}   # path -> ((mtime_ns, size), (letter_type, fields, templates) or LocaleFormat)
+        self.errors = {}  # path -> ((mtime_ns, size), message) for files that failed to reload
+        self.templates = {}  # (letter_type, locale, style) -> CompiledTemplate
+        self.locales = {}    # locale -> LocaleFormat
+        self.fields = {}
+        self.styles = []
+        self.locale_codes = []
+        self.generation = 0
+        self.fingerprint = ""
+        self.last_check = 0.0
+        self.lock = threading.Lock()
+        self.refresh(strict=True)
+
+    def _scan(self):
+        """{path: (mtime_ns, size)} of the template and locale files, in file name order"""
+        signatures = {}
+        for directory in (self.directory, self.locale_directory):
+            if not os.path.isdir(directory):
+                continue
+            with os.scandir(directory) as entries:
+                for entry in sorted(entries, key=lambda entry: entry.name):
+                    if entry.name.endswith(".toml") and entry.is_file():
+                        stat = entry.stat()
+                        signatures[entry.path] = (stat.st_mtime_ns, stat.st_size)
+        return signatures
+
+    def refresh(self, strict=False):
+        """Recompile changed or new files and drop removed ones; True if anything changed.
+
+        With strict, a file that fails to load raises ValueError instead of
+        keeping its previous version.
+        """
+        with self.lock:
+            self.last_check = time.monotonic()
+            signatures = self._scan()
+            changed = False
+            for path in [path for path in self.files if path not in signatures]:
+                del self.files[path]
+                changed = True
+            for path, signature in signatures.items():
+                loaded = self.files.get(path)
+                if loaded and loaded[0] == signature or self.errors.get(path, (None,))[0] == signature:
+                    continue
+                load = load_locale_file if os.path.dirname(path) == self.locale_directory else load_template_file
+                try:
+                    with metrics.phase("templates.compile"):
+                        definition = load(path)
+                except (OSError, ValueError) as e:
+                    if strict:
+                        raise ValueError(f"{path}: {e}") from e
+                    self.errors[path] = (signature, f"{type(e).__name__}: {e}")
+                    metrics.increment("templates.reload_error")
+                    continue
+                self.errors.pop(path, None)
+                self.files[path] = (signature, definition)
+                changed = True
+            if changed:
+                self._publish(strict)
+            return changed
+
+    def _publish(self, strict):
+        """Rebuild the lookup tables from the loaded files"""
+        templates = {}
+        locales = {}
+        fields = {}
+        styles = ["standard"]
+        for path, (signature, definition) in sorted(self.files.items()):
+            if isinstance(definition, LocaleFormat):
+                locales[definition.locale] = definition
+                continue
+            letter_type, letter_fields, letter_templates = definition
+            if letter_type in fields:
+                message = f"letter type '{letter_type}' is already defined by another file"
+                if strict:
+                    raise ValueError(f"{path}: {message}")
+                self.errors[path] = (signature, message)
+                continue
+            fields[letter_type] = letter_fields
+            for (locale, style), template in letter_templates.items():
+                templates[(letter_type, locale, style)] = template
+                if style not in styles:
+                    styles.append(style)
+        self.templates = templates
+        self.locales = locales
+        for letter_type in [letter_type for letter_type in self.fields if letter_type not in fields]:
+            del self.fields[letter_type]
+        self.fields.update(fields)
+        self.styles[:] = styles
+        self.locale_codes[:] = [DEFAULT_LOCALE] + sorted(code for code in locales if code != DEFAULT_LOCALE)
+        self.generation += 1
+        self.fingerprint = hashlib.sha256(repr((RENDER_VERSION, sorted(
+            (os.path.basename(path), signature) for path, (signature, _) in self.files.items()
+        ))).encode()).hexdigest()[:16]
+        metrics.increment("templates.reload")
+
+    def maybe_refresh(self):
+        """Refresh if the reload interval has passed since the last check"""
+        if time.monotonic() - self.last_check >= self.reload_interval:
+            self.refresh()
+
+    def resolve(self, letter_type, style, locale=None):
+        """The (locale, style) actually rendered after falling back to the default locale and standard style"""
+        if locale not in self.locales or (letter_type, locale, "standard") not in self.templates:
+            locale = DEFAULT_LOCALE
+        if (letter_type, locale, style) not in self.templates:
+            style = "standard"
+        return locale, style
+
+    def format_date(self, value, locale=DEFAULT_LOCALE):
+        """value in the locale's date format"""
+        locale_format = self.locales.get(locale)
+        return locale_format.format_date(value) if locale_format else value.strftime(DATE_FORMAT)
+
+    @metrics.timed("templates.render")
+    def render(self, letter_type, style, data, render_date=None, locale=None):
+        """Render a letter dated render_date (today if None) in locale (DEFAULT_LOCALE if None)"""
+        locale, style = self.resolve(letter_type, style, locale)
+        template = self.templates[(letter_type, locale, style)]
+        if any(type(value) is date for value in data.values()):
+            data = {field: self.format_date(value, locale) if type(value) is date else value
+                    for field, value in data.items()}
+        return template.render(data, self.format_date(render_date or date.today(), locale))
+
+
+TEMPLATE_REGISTRY = TemplateRegistry()
+# {letter_type: {field: {"required", "type", "label", "key", "widget", "column", "height", "max_length", "after"}}}
+LETTER_FIELDS = TEMPLATE_REGISTRY.fields
+LETTER_STYLES = TEMPLATE_REGISTRY.styles
+LETTER_LOCALES = TEMPLATE_REGISTRY.locale_codes
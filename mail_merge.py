@@ -0,0 +1,194 @@
+"""Headless bulk letter generation from CSV or JSONL exports.
+
+Usage:
+    python mail_merge.py employees.csv --letter-type "Application for Leave" --output-dir letters
+    python mail_merge.py requests.jsonl --letter-type "Complaint Letter" --format pdf --workers 8
+    python mail_merge.py hr_export.csv --letter-type "Resignation Letter" --format zip
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from datetime import date
+from itertools import islice
+
+from letter_core import (FONT_FILE, LETTER_FIELDS, LETTER_LOCALES, LETTER_STYLES, LetterSchema, LetterTemplates,
+                         PDFGenerator, StreamingPDFWriter)
+
+# "text" and "pdf" are written one file per letter by the workers; the
+# archive formats are streamed into a single file by the parent process
+OUTPUT_FORMATS = ["text", "pdf", "pdf-merged", "zip"]
+ARCHIVE_FILES = {"pdf-merged": "letters.pdf", "zip": "letters.zip"}
+
+
+def iter_records(path, input_format=None):
+    """Yield one dict per CSV row or JSONL line without reading the whole file"""
+    input_format = input_format or os.path.splitext(path)[1].lstrip(".").lower()
+    with open(path, "r", encoding="utf-8", newline="") as f:
+        if input_format == "csv":
+            yield from csv.DictReader(f)
+        elif input_format in ("jsonl", "ndjson"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+        else:
+            raise ValueError(f"Unsupported input format '{input_format}', expected csv or jsonl")
+
+
+def render_chunk(letter_type, style, output_format, output_dir, chunk, render_date=None, locale=None):
+    """Validate, render and write one chunk of (row number, record) pairs.
+
+    Runs inside a worker process. Per-letter formats are written here and only
+    counts and errors go back to the parent; archive formats send back the
+    chunk's rendered payloads for the parent to append to the archive.
+    """
+    pdf_gen = PDFGenerator() if output_format != "text" else None
+    rendered = 0
+    errors = []
+    payloads = []
+    validated = LetterSchema.for_letter_type(letter_type).validate_records([record for _, record in chunk])
+    for (row_number, _), (letter_data, problems) in zip(chunk, validated):
+        if problems:
+            errors.append((row_number, problems))
+            continue
+        name = f"letter_{row_number:07d}"
+        try:
+            letter = LetterTemplates.render(letter_type, style, letter_data, render_date, locale)
+            if output_format == "pdf-merged":
+                payloads.append(pdf_gen.page_streams(letter))
+            elif output_format == "zip":
+                payloads.append((name + ".pdf", pdf_gen.create_pdf(letter)))
+            elif pdf_gen:
+                with open(os.path.join(output_dir, name + ".pdf"), "wb") as f:
+                    f.write(pdf_gen.create_pdf(letter))
+            else:
+                with open(os.path.join(output_dir, name + ".txt"), "w", encoding="utf-8") as f:
+                    f.write(letter)
+        except (KeyError, ValueError, UnicodeError, OSError) as e:
+            errors.append((row_number, [f"{type(e).__name__}: {e}"]))
+            continue
+        rendered += 1
+    return len(chunk), rendered, errors, payloads
+
+
+def run_mail_merge(input_path, letter_type, style="standard", output_format="text",
+                   output_dir="letters", workers=None, chunk_size=500, input_format=None,
+                   progress=None, render_date=None, locale=None):
+    """Stream records from input_path into letters across a process pool.
+
+    At most two chunks per worker are in flight at any time and results are
+    consumed in input order, so memory stays bounded regardless of the input
+    size. Every letter is in locale and dated render_date, today if None,
+    even if the run crosses midnight. Row errors are appended to errors.jsonl in the output
+    directory. Returns a report dict.
+    """
+    if letter_type not in LETTER_FIELDS:
+        raise ValueError(f"Unknown letter type '{letter_type}'")
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output format '{output_format}'")
+    if chunk_size < 1:
+        raise ValueError("chunk_size must be at least 1")
+    workers = workers or os.cpu_count() or 1
+    render_date = render_date or date.today()
+    os.makedirs(output_dir, exist_ok=True)
+
+    records = enumerate(iter_records(input_path, input_format), start=1)
+    chunks = iter(lambda: list(islice(records, chunk_size)), [])
+    report = {"rows": 0, "rendered": 0, "failed": 0}
+    start = time.perf_counter()
+
+    with ExitStack() as stack:
+        errors_file = stack.enter_context(open(os.path.join(output_dir, "errors.jsonl"), "w", encoding="utf-8"))
+        archive = None
+        if output_format in ARCHIVE_FILES:
+            archive_file = stack.enter_context(open(os.path.join(output_dir, ARCHIVE_FILES[output_format]), "wb"))
+            if output_format == "zip":
+                archive = stack.enter_context(zipfile.ZipFile(archive_file, "w", zipfile.ZIP_DEFLATED))
+            else:
+                archive = StreamingPDFWriter(archive_file, FONT_FILE)
+
+        def collect(result):
+            rows, rendered, errors, payloads = result
+            for payload in payloads:
+                if output_format == "zip":
+                    archive.writestr(*payload)
+                else:
+                    archive.add_page_streams(*payload)
+            report["rows"] += rows
+            report["rendered"] += rendered
+            report["failed"] += len(errors)
+            for row_number, problems in errors:
+                errors_file.write(json.dumps({"row": row_number, "errors": problems}) + "\n")
+            if progress:
+                progress(report, time.perf_counter() - start)
+
+        if workers == 1:
+            for chunk in chunks:
+                collect(render_chunk(letter_type, style, output_format, output_dir, chunk, render_date, locale))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                pending = deque()
+                for chunk in chunks:
+                    if len(pending) >= workers * 2:
+                        collect(pending.popleft().result())
+                    pending.append(pool.submit(render_chunk, letter_type, style,
+                                               output_format, output_dir, chunk, render_date, locale))
+                while pending:
+                    collect(pending.popleft().result())
+        if output_format == "pdf-merged":
+            archive.close()
+
+    report["elapsed"] = time.perf_counter() - start
+    report["letters_per_second"] = report["rendered"] / report["elapsed"] if report["elapsed"] else 0.0
+    return report
+
+
+def format_report(report):
+    """Human readable summary of a mail merge run"""
+    return (
+        f"Rows: {report['rows']}  Rendered: {report['rendered']}  Failed: {report['failed']}  "
+        f"Elapsed: {report['elapsed']:.2f}s  Throughput: {report['letters_per_second']:.0f} letters/s"
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate letters in bulk from a CSV or JSONL file")
+    parser.add_argument("input", help="CSV or JSONL file with one letter per row")
+    parser.add_argument("--letter-type", required=True, choices=list(LETTER_FIELDS))
+    parser.add_argument("--style", default="standard", choices=LETTER_STYLES)
+    parser.add_argument("--format", dest="output_format", default="text", choices=OUTPUT_FORMATS)
+    parser.add_argument("--input-format", choices=["csv", "jsonl"],
+                        help="Override format detection from the file extension")
+    parser.add_argument("--output-dir", default="letters")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk-size", type=int, default=500, help="Records sent to a worker at a time")
+    parser.add_argument("--date", type=date.fromisoformat, default=None,
+                        help="Date printed on every letter, YYYY-MM-DD (default: today)")
+    parser.add_argument("--locale", default=None, choices=LETTER_LOCALES, help="Language of the letters")
+    parser.add_argument("--quiet", action="store_true", help="Only print the final report")
+    args = parser.parse_args(argv)
+
+    def progress(report, elapsed):
+        print(f"\r{report['rows']} rows, {report['rendered']} letters, "
+              f"{report['rendered'] / elapsed if elapsed else 0:.0f} letters/s",
+              end="", file=sys.stderr, flush=True)
+
+    report = run_mail_merge(
+        args.input, args.letter_type, args.style, args.output_format, args.output_dir,
+        args.workers, args.chunk_size, args.input_format, None if args.quiet else progress, args.date, args.locale,
+    )
+    if not args.quiet:
+        print(file=sys.stderr)
+    print(format_report(report))
+    return 1 if report["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,165 @@
+"""Process-wide latency histograms and counters for the app, CLI and API.
+
+Set LETTER_METRICS=0 to turn instrumentation off: timed() then returns the
+function unchanged and phase() a shared no-op context manager. Set
+LETTER_METRICS_FILE to a .json or .prom path to have the Streamlit app write a
+snapshot there at most every LETTER_METRICS_INTERVAL seconds (default 10).
+"""
+import json
+import os
+import tempfile
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+ENABLED = os.environ.get("LETTER_METRICS", "1") != "0"
+EXPORT_FILE = os.environ.get("LETTER_METRICS_FILE")
+EXPORT_INTERVAL = float(os.environ.get("LETTER_METRICS_INTERVAL", "10"))
+# Upper bounds in seconds of the histogram buckets, as in Prometheus client defaults
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_NULL_CONTEXT = nullcontext()
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)  # last slot is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return {
+            "count": self.count, "sum": self.sum,
+            "buckets": dict(zip([str(bound) for bound in BUCKETS] + ["+Inf"], cumulative)),
+        }
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.gauges = {}
+        self.lock = threading.Lock()
+        self.last_export = 0.0
+
+    def observe(self, name, seconds):
+        """Record one duration for name"""
+        with self.lock:
+            histogram = self.histograms.get(name)
+            if histogram is None:
+                histogram = self.histograms[name] = Histogram()
+            histogram.observe(seconds)
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def register_gauges(self, prefix, read):
+        """Report the numeric values of the dict returned by read() as prefix.<key> gauges"""
+        with self.lock:
+            self.gauges[prefix] = read
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start)
+
+    def snapshot(self):
+        """All metrics as plain data"""
+        with self.lock:
+            histograms = {name: histogram.snapshot() for name, histogram in self.histograms.items()}
+            counters = dict(self.counters)
+            gauge_sources = list(self.gauges.items())
+        gauges = {}
+        for prefix, read in gauge_sources:
+            for key, value in read().items():
+                if isinstance(value, (int, float)):
+                    gauges[f"{prefix}.{key}"] = value
+        return {"histograms": histograms, "counters": counters, "gauges": gauges}
+
+    def to_prometheus(self):
+        """Snapshot in the Prometheus text exposition format"""
+        snapshot = self.snapshot()
+        lines = ["# TYPE letter_duration_seconds histogram"]
+        for name, histogram in sorted(snapshot["histograms"].items()):
+            for bound, count in histogram["buckets"].items():
+                lines.append(f'letter_duration_seconds_bucket{{name="{name}",le="{bound}"}} {count}')
+            lines.append(f'letter_duration_seconds_sum{{name="{name}"}} {histogram["sum"]}')
+            lines.append(f'letter_duration_seconds_count{{name="{name}"}} {histogram["count"]}')
+        lines.append("# TYPE letter_events_total counter")
+        for name, value in sorted(snapshot["counters"].items()):
+            lines.append(f'letter_events_total{{name="{name}"}} {value}')
+        lines.append("# TYPE letter_gauge gauge")
+        for name, value in sorted(snapshot["gauges"].items()):
+            lines.append(f'letter_gauge{{name="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """Atomically write a snapshot, as Prometheus text for .prom files and JSON otherwise"""
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.snapshot(), indent=2)
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory)
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+        os.replace(temp_path, path)
+
+    def maybe_export(self):
+        """Write to LETTER_METRICS_FILE if set and the export interval has passed"""
+        if not (ENABLED and EXPORT_FILE):
+            return
+        now = time.monotonic()
+        with self.lock:
+            if now - self.last_export < EXPORT_INTERVAL:
+                return
+            self.last_export = now
+        self.write(EXPORT_FILE)
+
+
+REGISTRY = MetricsRegistry()
+
+
+def timed(name):
+    """Decorator recording each call's duration under name; a no-op when metrics are off"""
+    def decorator(func):
+        if not ENABLED:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                REGISTRY.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def phase(name):
+    """Context manager timing a block under name"""
+    if not ENABLED:
+        return _NULL_CONTEXT
+    return REGISTRY.timer(name)
+
+
+def increment(name, amount=1):
+    if ENABLED:
+        REGISTRY.increment(name, amount)
@@ -0,0 +1,31 @@
+"""Copy users and saved templates from users.json into a SQLite or sharded store.
+
+Usage:
+    python migrate_users.py [users.json] [users.db]
+    python migrate_users.py --sharded [users.json] [users]
+
+Then start the app with USER_STORE=sqlite (and USER_DB_FILE if the database
+is not users.db), or with USER_STORE=sharded (and USER_SHARD_DIR if the
+directory is not users).
+"""
+import sys
+
+from letter_core import migrate_users_to_shards, migrate_users_to_sqlite
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    sharded = "--sharded" in argv
+    argv = [arg for arg in argv if arg != "--sharded"]
+    users_file = argv[0] if len(argv) > 0 else "users.json"
+    if sharded:
+        target = argv[1] if len(argv) > 1 else "users"
+        users, templates = migrate_users_to_shards(users_file, target)
+    else:
+        target = argv[1] if len(argv) > 1 else "users.db"
+        users, templates = migrate_users_to_sqlite(users_file, target)
+    print(f"Migrated {users} users and {templates} templates from {users_file} to {target}")
+
+
+if __name__ == "__main__":
+    main()
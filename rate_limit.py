@@ -0,0 +1,153 @@
+"""Token bucket rate limiting for the app and the API.
+
+Each operation ("generate", "pdf", "write") has a bucket per user and one
+shared by all users. Limits default to DEFAULT_RATE_LIMITS and can be set
+with RATE_LIMIT_<OPERATION> variables, see RateLimiter.from_env.
+"""
+import os
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import metrics
+
+# (per-user rate, per-user burst, global rate, global burst) per operation, in requests per second;
+# override with RATE_LIMIT_<OPERATION>="user_rate:user_burst,global_rate:global_burst", a rate of 0 disables
+DEFAULT_RATE_LIMITS = {"generate": (2, 10, 50, 200), "pdf": (1, 5, 20, 50), "write": (1, 10, 50, 100)}
+OPERATION_NAMES = {"generate": "letter generation", "pdf": "PDF download", "write": "account update"}
+
+
+class RateLimited(Exception):
+    """Raised by RateLimiter.acquire when a request is over its user's or the global rate"""
+
+    def __init__(self, operation, scope, retry_after):
+        self.operation = operation
+        self.scope = scope
+        self.retry_after = retry_after
+        who = "from you" if scope == "user" else "from everyone right now"
+        super().__init__(f"Too many {OPERATION_NAMES.get(operation, operation)} requests {who}. "
+                         f"Please try again in {max(1, round(retry_after))} s.")
+
+
+class TokenBucket:
+    """Allows rate requests per second on average and bursts of up to capacity"""
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity, now):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def take(self, now, cost=1):
+        """Take cost tokens, returning 0.0 or, if there are too few, the seconds until there will be enough"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def give_back(self, cost=1):
+        self.tokens = min(self.capacity, self.tokens + cost)
+
+
+class RateLimiter:
+    """Token buckets per (operation, user) and per operation across all users.
+
+    A request must fit both its user's bucket and the global one, so one
+    user's load cannot use up everyone else's capacity. limits maps each
+    operation to (user rate, user burst, global rate, global burst); an
+    operation without limits, or a rate of 0, is not limited. The buckets of
+    the least recently active users are dropped beyond max_users.
+    """
+
+    def __init__(self, limits=None, max_users=10000):
+        self.limits = DEFAULT_RATE_LIMITS if limits is None else limits
+        self.max_users = max_users
+        self.user_buckets = OrderedDict()
+        self.global_buckets = {}
+        self.throttled = Counter()
+        self.admitted = Counter()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """Limiter with DEFAULT_RATE_LIMITS overridden by the RATE_LIMIT_<OPERATION> variables"""
+        limits = dict(DEFAULT_RATE_LIMITS)
+        for operation in limits:
+            value = os.environ.get(f"RATE_LIMIT_{operation.upper()}")
+            if value:
+                try:
+                    numbers = tuple(float(number) for scope in value.split(",") for number in scope.split(":"))
+                    if len(numbers) != 4:
+                        raise ValueError
+                except ValueError:
+                    message = f"RATE_LIMIT_{operation.upper()} must look like 2:10,50:200, not {value!r}"
+                    raise ValueError(message) from None
+                limits[operation] = numbers
+        return cls(limits)
+
+    def acquire(self, operation, user, cost=1):
+        """Admit one request by user, or raise RateLimited without using up any tokens"""
+        limits = self.limits.get(operation)
+        if limits is None:
+            return
+        user_rate, user_burst, global_rate, global_burst = limits
+        with self.lock:
+            now = time.monotonic()
+            user_bucket = None
+            if user_rate:
+                key = (operation, user)
+                user_bucket = self.user_buckets.get(key)
+                if user_bucket is None:
+                    user_bucket = self.user_buckets[key] = TokenBucket(user_rate, user_burst, now)
+                    while len(self.user_buckets) > self.max_users:
+                        self.user_buckets.popitem(last=False)
+                else:
+                    self.user_buckets.move_to_end(key)
+                retry_after = user_bucket.take(now, cost)
+                if retry_after:
+                    self._throttle(operation, "user")
+                    raise RateLimited(operation, "user", retry_after)
+            if global_rate:
+                global_bucket = self.global_buckets.get(operation)
+                if global_bucket is None:
+                    global_bucket = self.global_buckets[operation] = TokenBucket(global_rate, global_burst, now)
+                retry_after = global_bucket.take(now, cost)
+                if retry_after:
+                    if user_bucket is not None:
+                        user_bucket.give_back(cost)
+                    self._throttle(operation, "global")
+                    raise RateLimited(operation, "global", retry_after)
+            self.admitted[operation] += 1
+
+    def release(self, operation, user, cost=1):
+        """Give back the tokens of an admitted request that was then refused for another operation"""
+        if self.limits.get(operation) is None:
+            return
+        with self.lock:
+            for bucket in (self.user_buckets.get((operation, user)), self.global_buckets.get(operation)):
+                if bucket is not None:
+                    bucket.give_back(cost)
+            self.admitted[operation] -= 1
+
+    def max_cost(self, operation):
+        """Largest cost acquire can ever admit for operation, its smallest burst, or None if unlimited"""
+        limits = self.limits.get(operation)
+        if limits is None:
+            return None
+        user_rate, user_burst, global_rate, global_burst = limits
+        bursts = [burst for rate, burst in ((user_rate, user_burst), (global_rate, global_burst)) if rate]
+        return int(min(bursts)) if bursts else None
+
+    def _throttle(self, operation, scope):
+        self.throttled[f"{operation}.{scope}"] += 1
+        metrics.increment(f"ratelimit.{operation}.{scope}_throttled")
+
+    def stats(self):
+        with self.lock:
+            stats = {"users": len(self.user_buckets)}
+            stats.update((f"{operation}.admitted", count) for operation, count in self.admitted.items())
+            stats.update((f"{key}_throttled", count) for key, count in self.throttled.items())
+            return stats
@@ -0,0 +1,83 @@
+import asyncio
+import http.client
+import io
+import json
+import threading
+import zipfile
+
+import pytest
+
+from api_server import LetterAPIServer
+from letter_core import LetterTemplates
+from rate_limit import RateLimiter
+
+LETTER = {"letter_type": "Complaint Letter", "date": "2024-05-01",
+          "data": {"name": "Alex", "recipient": "Customer Service", "issue": "Late delivery"}}
+
+
+@pytest.fixture(scope="module")
+def server():
+    loop = asyncio.new_event_loop()
+    server = loop.run_until_complete(LetterAPIServer(port=0, workers=1).start())
+    server.limiter = RateLimiter(limits={})
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server
+    asyncio.run_coroutine_threadsafe(server.close(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+def post(server, path, payload):
+    connection = http.client.HTTPConnection(server.host, server.port, timeout=60)
+    try:
+        connection.request("POST", path, json.dumps(payload), {"Content-Type": "application/json"})
+        response = connection.getresponse()
+        return response.status, response.getheader("Content-Type"), response.read()
+    finally:
+        connection.close()
+
+
+def test_text_letter(server):
+    status, content_type, body = post(server, "/letters", LETTER)
+    assert status == 200 and content_type.startswith("text/plain")
+    assert "Late delivery" in body.decode("utf-8")
+
+
+def test_pdf_letter(server):
+    status, content_type, body = post(server, "/letters", dict(LETTER, format="pdf"))
+    assert status == 200 and content_type == "application/pdf"
+    assert body.startswith(b"%PDF-")
+
+
+def test_zip_batch(server):
+    status, content_type, body = post(server, "/letters:batch", {"format": "zip", "letters": [LETTER, LETTER]})
+    assert status == 200 and content_type == "application/zip"
+    assert len(zipfile.ZipFile(io.BytesIO(body)).namelist()) == 2
+
+
+def test_invalid_letter_is_422(server):
+    letter = dict(LETTER, data={"name": "Alex"})
+    status, _, body = post(server, "/letters:batch", {"letters": [LETTER, letter]})
+    assert status == 422
+    error = json.loads(body)
+    assert error["error"] == "Invalid letters in batch" and error["details"][0]["index"] == 1
+
+
+def test_unexpected_error_is_500(server, monkeypatch):
+    def fail(*args, **kwargs):
+        raise RuntimeError("template store unavailable")
+    monkeypatch.setattr(LetterTemplates, "render", staticmethod(fail))
+    status, content_type, body = post(server, "/letters", LETTER)
+    assert status == 500 and content_type == "application/json"
+    assert json.loads(body) == {"error": "Internal server error"}
+
+
+def test_invalid_letters_cost_no_tokens(server, monkeypatch):
+    monkeypatch.setattr(server, "limiter", RateLimiter(limits={"generate": (0.001, 2, 0, 0)}))
+    letter = dict(LETTER, data={"name": "Alex"})
+    for _ in range(3):
+        assert post(server, "/letters:batch", {"letters": [letter, letter]})[0] == 422
+    assert post(server, "/letters:batch", {"letters": [LETTER, LETTER]})[0] == 200
+    assert post(server, "/letters", LETTER)[0] == 429
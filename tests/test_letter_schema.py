@@ -0,0 +1,27 @@
+from datetime import date
+
+from letter_core import LetterSchema, validate_letter_data
+
+COMPLAINT = {"name": "Alex", "recipient": "Customer Service", "issue": "Late delivery"}
+
+
+def test_whitespace_only_required_field_is_missing():
+    _, errors = validate_letter_data("Complaint Letter", dict(COMPLAINT, name="  \t\n"))
+    assert errors == ["missing required field 'name'"]
+
+
+def test_values_are_stripped_and_blank_optional_fields_left_out():
+    letter_data, errors = validate_letter_data(
+        "Complaint Letter", dict(COMPLAINT, name="  Alex ", organization=" ", date_occurred=" 2024-05-01 "))
+    assert errors == []
+    assert letter_data["name"] == "Alex" and "organization" not in letter_data
+    assert letter_data["date_occurred"] == date(2024, 5, 1)
+
+
+def test_records_are_validated_by_column():
+    results = LetterSchema.for_letter_type("Complaint Letter").validate_records(
+        [COMPLAINT, dict(COMPLAINT, issue=" "), {}])
+    assert [errors for _, errors in results] == [
+        [], ["missing required field 'issue'"],
+        ["missing required field 'name'", "missing required field 'recipient'", "missing required field 'issue'"],
+    ]
@@ -0,0 +1,7 @@
+from letter_templates import LETTER_FIELDS, LETTER_LOCALES, LETTER_STYLES, TEMPLATE_REGISTRY
+
+
+def test_every_style_is_translated_in_every_locale():
+    missing = [(letter_type, locale, style) for letter_type in LETTER_FIELDS for locale in LETTER_LOCALES
+               for style in LETTER_STYLES if TEMPLATE_REGISTRY.resolve(letter_type, style, locale) != (locale, style)]
+    assert missing == []
@@ -0,0 +1,71 @@
+import io
+import re
+import zlib
+
+import pytest
+
+pytest.importorskip("fpdf")
+
+from letter_core import PDFGenerator, find_unicode_font
+
+LETTERS = ["Dear Sam,\n\nThank you.\n\nAlex", "Short", "A long letter.\n" * 200]
+
+
+def check_xref(pdf):
+    """Assert every xref entry and startxref point at the object or table they name"""
+    startxref = int(re.search(rb"startxref\n(\d+)\n%%EOF\n$", pdf).group(1))
+    assert pdf[startxref:].startswith(b"xref\n")
+    header = re.match(rb"xref\n0 (\d+)\n0000000000 65535 f \n", pdf[startxref:])
+    size = int(header.group(1))
+    entries = pdf[startxref + header.end():].split(b"\n")[:size - 1]
+    for number, entry in enumerate(entries, start=1):
+        offset = int(entry[:10])
+        assert pdf[offset:].startswith(b"%d 0 obj\n" % number), number
+    assert re.search(rb"trailer\n<</Size %d\n" % size, pdf)
+    return size
+
+
+def write(generator, letters):
+    buffer = io.BytesIO()
+    pages = generator.write_combined_pdf(letters, buffer)
+    return pages, buffer.getvalue()
+
+
+def test_combined_pdf_xref_offsets():
+    generator = PDFGenerator()
+    pages, pdf = write(generator, LETTERS)
+    assert pages == sum(len(generator.page_streams(letter)[0]) for letter in LETTERS)
+    # Two objects per page, the three shared objects, info and catalog
+    assert check_xref(pdf) == 1 + 3 + 2 * pages + 2
+    assert b"/Count %d\n" % pages in pdf
+
+
+def test_combined_pdf_pages_match_single_letter_layout():
+    generator = PDFGenerator()
+    _, pdf = write(generator, LETTERS[:1])
+    stream = re.search(rb"/Length (\d+)>>\nstream\n", pdf)
+    content = pdf[stream.end():stream.end() + int(stream.group(1))]
+    assert zlib.decompress(content) == zlib.decompress(generator.page_streams(LETTERS[0])[0][0])
+
+
+def test_combined_pdf_xref_offsets_with_embedded_font():
+    font_file = find_unicode_font()
+    if font_file is None:
+        pytest.skip("no Unicode TrueType font installed")
+    _, pdf = write(PDFGenerator(font_file=font_file), LETTERS + ["Grüße, Ζωή, Дякую"])
+    check_xref(pdf)
+    assert b"/FontFile2" in pdf
+
+
+def test_combined_pdf_falls_back_to_unicode_font_for_non_latin1_letters():
+    if find_unicode_font() is None:
+        pytest.skip("no Unicode TrueType font installed")
+    generator = PDFGenerator(font_file=None)
+    pages, pdf = write(generator, ["Dear Sam", "Дякую, Ζωή", "Short"])
+    assert pages == 3
+    check_xref(pdf)
+    assert b"/BaseFont /Helvetica" in pdf and b"/FontFile2" in pdf
+    # Only the Cyrillic page uses the resources of the embedded fallback font
+    resources = re.findall(rb"/Resources (\d+) 0 R", pdf)
+    assert resources[0] == resources[2] == b"2" and resources[1] != b"2"
+    assert b"/Count 3\n" in pdf
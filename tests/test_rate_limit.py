@@ -0,0 +1,71 @@
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limit
+from rate_limit import RateLimited, RateLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(rate_limit, "time", SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+def test_burst_then_refill(clock):
+    limiter = RateLimiter({"generate": (2, 3, 0, 0)})
+    for _ in range(3):
+        limiter.acquire("generate", "alex")
+    with pytest.raises(RateLimited):
+        limiter.acquire("generate", "alex")
+    clock[0] += 0.5  # one token back at two per second
+    limiter.acquire("generate", "alex")
+    with pytest.raises(RateLimited):
+        limiter.acquire("generate", "alex")
+    clock[0] += 60  # refills up to the burst, no further
+    for _ in range(3):
+        limiter.acquire("generate", "alex")
+    with pytest.raises(RateLimited):
+        limiter.acquire("generate", "alex")
+
+
+def test_users_and_operations_have_their_own_buckets(clock):
+    limiter = RateLimiter({"generate": (1, 1, 0, 0), "pdf": (1, 1, 0, 0)})
+    limiter.acquire("generate", "alex")
+    limiter.acquire("generate", "sam")
+    limiter.acquire("pdf", "alex")
+    with pytest.raises(RateLimited) as refused:
+        limiter.acquire("generate", "alex")
+    assert refused.value.scope == "user"
+    limiter.acquire("write", "alex")  # no limits configured
+
+
+def test_global_limit_refunds_the_user_bucket(clock):
+    limiter = RateLimiter({"generate": (1, 2, 1, 1)})
+    limiter.acquire("generate", "alex")
+    with pytest.raises(RateLimited) as refused:
+        limiter.acquire("generate", "sam")
+    assert refused.value.scope == "global"
+    clock[0] += 1
+    limiter.acquire("generate", "sam")  # its token was given back, and the global one refilled
+
+
+def test_retry_after_is_the_time_until_enough_tokens(clock):
+    limiter = RateLimiter({"pdf": (0.5, 4, 0, 0)})
+    limiter.acquire("pdf", "alex", cost=4)
+    clock[0] += 1
+    with pytest.raises(RateLimited) as refused:
+        limiter.acquire("pdf", "alex", cost=3)
+    assert refused.value.retry_after == pytest.approx(5.0)  # 0.5 tokens held, 2.5 more at 0.5 per second
+    clock[0] += 5
+    limiter.acquire("pdf", "alex", cost=3)
+    assert limiter.max_cost("pdf") == 4
+
+
+def test_limits_from_env(monkeypatch):
+    monkeypatch.setenv("RATE_LIMIT_PDF", "3:6,30:60")
+    assert RateLimiter.from_env().limits["pdf"] == (3, 6, 30, 60)
+    monkeypatch.setenv("RATE_LIMIT_PDF", "3:6")
+    with pytest.raises(ValueError):
+        RateLimiter.from_env()
@@ -0,0 +1,31 @@
+import glob
+import os
+
+from letter_core import ShardedUserManager
+
+
+def blob_files(directory):
+    return sorted(os.path.basename(path) for path in glob.glob(os.path.join(directory, "**", "*"), recursive=True)
+                  if os.path.isfile(path) and len(os.path.basename(path)) == 64)
+
+
+def template(content):
+    return {"type": "Complaint Letter", "style": "standard", "content": content, "data": {"name": "Alex"}}
+
+
+def test_shards_share_one_blob_store(tmp_path):
+    manager = ShardedUserManager(str(tmp_path / "users"), shard_count=8)
+    usernames = [f"user{i}" for i in range(20)]
+    assert len({manager.shard_index(username) for username in usernames}) > 1
+    for username in usernames:
+        manager.register_user(username, "password", "user@example.com", username)
+        manager.save_user_template(username, "letter", template("Same letter"))
+    assert len(blob_files(str(tmp_path / "users"))) == 1
+
+    for username in usernames[:-1]:
+        manager.delete_user_template(username, "letter")
+    reopened = ShardedUserManager(str(tmp_path / "users"))
+    assert reopened.get_user_template(usernames[-1], "letter")["content"] == "Same letter"
+
+    manager.delete_user_template(usernames[-1], "letter")
+    assert blob_files(str(tmp_path / "users")) == []
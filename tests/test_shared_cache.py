@@ -0,0 +1,27 @@
+import sqlite3
+
+from letter_core import SharedCache
+
+
+def usage(cache):
+    with sqlite3.connect(cache.db_file) as connection:
+        return connection.execute("SELECT bytes FROM usage WHERE id = 0").fetchone()[0]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache.db"), max_bytes=250)
+    for n in range(3):
+        cache.put("letters", f"key{n}", "v1", bytes(100))
+    assert cache.get("letters", "key0", "v1") is None
+    assert cache.get("letters", "key2", "v1") == bytes(100)
+    assert usage(cache) == 200
+
+
+def test_put_recounts_usage_that_no_entries_account_for(tmp_path):
+    cache = SharedCache(str(tmp_path / "cache.db"), max_bytes=250)
+    cache.put("letters", "key", "v1", bytes(100))
+    cache.connection.execute("UPDATE usage SET bytes = 10000 WHERE id = 0")
+    cache.put("letters", "other", "v1", bytes(100))  # evicts everything and must still return
+    assert usage(cache) == 0 and cache.errors == 0
+    cache.put("letters", "key", "v1", bytes(100))
+    assert cache.get("letters", "key", "v1") == bytes(100) and usage(cache) == 100
@@ -0,0 +1,132 @@
+import glob
+import json
+import os
+
+from letter_core import TemplateIndex, UserManager
+
+
+def blob_files(directory):
+    return sorted(os.path.basename(path) for path in glob.glob(os.path.join(directory, "**", "*"), recursive=True)
+                  if os.path.isfile(path) and len(os.path.basename(path)) == 64)
+
+
+def template(content):
+    return {"type": "Complaint Letter", "style": "standard", "content": content, "data": {"name": "Alex"}}
+
+
+def new_manager(tmp_path, **kwargs):
+    manager = UserManager(str(tmp_path / "users.json"), **kwargs)
+    for username in ("alex", "sam"):
+        manager.register_user(username, "password", f"{username}@example.com", username.title())
+    return manager
+
+
+def test_identical_content_is_stored_once_and_deleted_with_its_last_reference(tmp_path):
+    manager = new_manager(tmp_path)
+    manager.save_user_template("alex", "first", template("Same letter"))
+    manager.save_user_template("alex", "second", template("Same letter"))
+    manager.save_user_template("sam", "copy", template("Same letter"))
+    assert len(blob_files(manager.blob_dir)) == 1
+
+    manager.delete_user_template("alex", "first")
+    manager.delete_user_template("sam", "copy")
+    assert len(blob_files(manager.blob_dir)) == 1
+    assert manager.get_user_template("alex", "second")["content"] == "Same letter"
+
+    manager.delete_user_template("alex", "second")
+    assert blob_files(manager.blob_dir) == []
+
+
+def test_overwriting_a_template_deletes_its_old_content(tmp_path):
+    manager = new_manager(tmp_path)
+    manager.save_user_template("alex", "letter", template("First draft"))
+    manager.save_user_template("alex", "letter", template("Second draft"))
+    assert len(blob_files(manager.blob_dir)) == 1
+    reopened = UserManager(manager.users_file)
+    assert reopened.get_user_template("alex", "letter")["content"] == "Second draft"
+
+
+def test_file_keeps_references_not_content(tmp_path):
+    manager = new_manager(tmp_path)
+    manager.save_user_template("alex", "letter", template("Dear Sam"))
+    with open(manager.users_file) as f:
+        stored = json.load(f)["alex"]["templates"]["letter"]
+    assert "content" not in stored and stored["content_ref"] in blob_files(manager.blob_dir)
+
+
+def test_inline_content_moves_to_blobs_on_next_write(tmp_path):
+    path = tmp_path / "users.json"
+    path.write_text(json.dumps({"alex": {"password": "0" * 64, "templates": {"old": template("Written inline")}}}))
+    manager = UserManager(str(path))
+    assert manager.get_user_template("alex", "old")["content"] == "Written inline"
+    manager.register_user("sam", "password", "sam@example.com", "Sam")
+    assert len(blob_files(manager.blob_dir)) == 1
+    assert UserManager(str(path)).get_user_template("alex", "old")["content"] == "Written inline"
+
+
+def test_deferred_delete_keeps_the_blob_until_flushed(tmp_path):
+    manager = new_manager(tmp_path, write_behind_ms=60_000)
+    manager.save_user_template("alex", "letter", template("Deferred"))
+    manager.flush()
+    manager.delete_user_template("alex", "letter")
+    assert len(blob_files(manager.blob_dir)) == 1  # the file on disk still refers to it
+    manager.flush()
+    assert blob_files(manager.blob_dir) == []
+
+
+def test_template_index_follows_saves_deletes_and_other_processes(tmp_path, monkeypatch):
+    manager = new_manager(tmp_path)
+    for n in range(5):
+        manager.save_user_template("alex", f"letter{n}", template(f"Refund for order {n}"))
+    assert manager.search_user_templates("alex", "refund") == ([f"letter{n}" for n in range(5)], 5)
+
+    reads = []
+    load_blob = UserManager._load_blob
+    monkeypatch.setattr(UserManager, "_load_blob", lambda self, digest: reads.append(digest) or load_blob(self, digest))
+    manager.save_user_template("alex", "zebra", template("Zebra crossing"))
+    manager.delete_user_template("alex", "letter0")
+    assert manager.search_user_templates("alex", "zeb") == (["zebra"], 1)
+    assert manager.search_user_templates("alex", "refund")[1] == 4
+    assert reads == []  # own saves and deletes update the index in place
+
+    other = UserManager(manager.users_file)
+    other.save_user_template("alex", "letter1", template("Goodbye"))
+    manager.refresh()
+    assert manager.search_user_templates("alex", "goodbye") == (["letter1"], 1)
+    assert len(reads) == 1  # only the template changed elsewhere is read back
+    fresh = TemplateIndex(manager.get_user_templates("alex"))
+    assert manager.template_indexes["alex"].postings == fresh.postings
+
+
+def test_template_indexes_are_bounded(tmp_path):
+    manager = new_manager(tmp_path, max_template_indexes=1)
+    manager.search_user_templates("alex")
+    manager.search_user_templates("sam")
+    assert list(manager.template_indexes) == ["sam"]
+
+
+def test_unreadable_users_file_is_reported_not_overwritten(tmp_path):
+    manager = new_manager(tmp_path)
+    manager.save_user_template("alex", "letter", template("Dear Sam"))
+    with open(manager.users_file, "w") as f:
+        f.write("{not json")
+    registered, message = manager.register_user("kim", "password", "kim@example.com", "Kim")
+    assert not registered and message.startswith("Could not save the user")
+    deleted, message = manager.delete_user_template("alex", "letter")
+    assert not deleted and message.startswith("Could not delete the template")
+    assert manager.save_user_template("alex", "other", template("Dear Kim")) is False
+    with open(manager.users_file) as f:
+        assert f.read() == "{not json"
+
+
+def test_reads_follow_a_template_deleted_by_another_process(tmp_path):
+    manager = new_manager(tmp_path)
+    manager.save_user_template("alex", "letter", template("Dear Sam"))
+    manager.save_user_template("alex", "kept", template("Dear Kim"))
+    other = UserManager(manager.users_file)
+    other.delete_user_template("alex", "letter")  # also deletes the blob manager still refers to
+    assert manager.get_user_templates("alex") == {"kept": template("Dear Kim")}
+    manager.save_user_template("alex", "letter", template("Dear Sam"))
+    other.refresh()
+    other.save_user_template("alex", "letter", template("Dear Alex"))
+    assert manager.get_user_template("alex", "letter")["content"] == "Dear Alex"
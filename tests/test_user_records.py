@@ -0,0 +1,75 @@
+import pickle
+
+import pytest
+
+from user_records import SavedTemplate, User, pack_timestamp, users_from_json, users_to_json
+
+TEMPLATE = {
+    "type": "Application for Leave", "style": "standard", "content_ref": "ab" * 32,
+    "data": {"name": "Alex Doe", "from_date": "2025-01-02"}, "created_at": "2025-01-02T10:20:30.123456",
+}
+USER = {
+    "password": "0f" * 32, "email": "alex@example.com", "full_name": "Alex Doe",
+    "templates": {"leave": TEMPLATE}, "created_at": "2025-01-02T10:20:30",
+}
+
+
+def round_trip(users):
+    return users_to_json(users_from_json(users))
+
+
+def test_round_trip_packs_every_slot():
+    user = User.from_json(USER)
+    assert user.extra is None
+    assert type(user.created_at) is int and type(user.password_hash) is bytes
+    assert round_trip({"alex": USER}) == {"alex": USER}
+
+
+@pytest.mark.parametrize("value", [
+    "2025-01-02T10:20:30.000000",  # isoformat() drops zero microseconds
+    "2025-01-02 10:20:30",
+    "2025-01-02T10:20:30+00:00",
+    "2025-01-02",
+    "yesterday",
+])
+def test_timestamps_that_cannot_be_packed_are_kept_as_strings(value):
+    assert pack_timestamp(value) is None
+    users = {"alex": dict(USER, created_at=value, templates={"leave": dict(TEMPLATE, created_at=value)})}
+    assert round_trip(users) == users
+
+
+@pytest.mark.parametrize("password", ["AB" * 32, "abc", "zz" * 32, 12345])
+def test_passwords_that_cannot_be_packed_are_kept(password):
+    users = {"alex": dict(USER, password=password)}
+    assert round_trip(users) == users
+    assert User.from_json(users["alex"]).password == password
+
+
+def test_nulls_and_unexpected_types_are_kept():
+    users = {
+        "alex": {"password": None, "email": None, "full_name": 7, "templates": None, "created_at": None},
+        "sam": dict(USER, templates={"bad": {"type": None, "data": ["not", "a", "dict"], "created_at": 1}}),
+    }
+    assert round_trip(users) == users
+
+
+def test_unknown_keys_are_kept():
+    users = {"alex": dict(USER, role="admin", templates={"leave": dict(TEMPLATE, tags=["hr"])})}
+    assert round_trip(users) == users
+
+
+def test_templates_with_the_same_fields_share_their_keys():
+    first = SavedTemplate.from_json(TEMPLATE)
+    second = SavedTemplate.from_json(dict(TEMPLATE, data={"name": "Sam Lee", "from_date": "2025-02-03"}))
+    assert first.data_keys is second.data_keys
+
+
+def test_pickle_round_trip():
+    users = {
+        "alex": USER,
+        "sam": dict(USER, password="abc", role="admin", created_at="yesterday",
+                    templates={"inline": {"content": "Dear Sam", "data": None, "tags": ["hr"]}}),
+    }
+    loaded = pickle.loads(pickle.dumps(users_from_json(users), pickle.HIGHEST_PROTOCOL))
+    assert users_to_json(loaded) == users
+    assert loaded["alex"].templates["leave"].data_keys is SavedTemplate.from_json(TEMPLATE).data_keys
@@ -0,0 +1,251 @@
+"""Compact in-memory records for users and their saved templates.
+
+UserManager can hold hundreds of thousands of users in one long-lived
+process, so instead of nested dicts each user and saved template is a
+__slots__ record:
+
+    letter type and style    interned, so every template shares one string
+    content_ref              interned, shared by templates with the same body
+    created_at               integer microseconds since EPOCH
+    password hash            32 raw bytes instead of 64 hex characters
+    data                     a values tuple, with the tuple of keys shared by
+                             every template that has the same fields
+
+from_json and to_json convert losslessly to and from the users.json shape:
+a value that would not come back unchanged from its compact form, or a key
+the record has no slot for, is kept as-is in the record's extra dict.
+Records also pickle as a flat tuple of their slots, which loads several
+times faster than parsing and converting the JSON again.
+"""
+import gc
+import sys
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+MICROSECOND = timedelta(microseconds=1)
+# Key tuples of template data, shared by every template with the same fields
+_DATA_KEYS = {}
+
+
+def pack_timestamp(value):
+    """Naive ISO timestamp as integer microseconds since EPOCH, or None unless it is in exactly isoformat()'s shape"""
+    # YYYY-MM-DDTHH:MM:SS with an optional non-zero .ffffff; anything else would not come back the same
+    if value[4:17:3] != "--T::":
+        return None
+    if len(value) == 26:
+        if value[19] != "." or value[20:] == "000000":
+            return None
+    elif len(value) != 19:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    return (parsed - EPOCH) // MICROSECOND
+
+
+def unpack_timestamp(micros):
+    return (EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+def pack_created_at(value):
+    """Packed timestamp, or the string itself if it cannot be packed losslessly"""
+    packed = pack_timestamp(value)
+    return value if packed is None else packed
+
+
+def unpack_created_at(value):
+    return unpack_timestamp(value) if type(value) is int else value
+
+
+class Record:
+    """Base of the records; SLOTS maps each JSON key to the slot holding its packed value"""
+    __slots__ = ()
+    SLOTS = {}
+
+    def _keep_unpacked(self, obj):
+        """Move values that could not be packed, such as nulls or unexpected types, into extra"""
+        for key, slot in self.SLOTS.items():
+            if key in obj and getattr(self, slot) is None:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = obj[key]
+
+
+class SavedTemplate(Record):
+    __slots__ = ("type", "style", "content", "content_ref", "data_keys", "data_values", "created_at", "extra")
+    SLOTS = {"type": "type", "style": "style", "content": "content", "content_ref": "content_ref",
+             "data": "data_keys", "created_at": "created_at"}
+
+    @classmethod
+    def from_json(cls, obj):
+        template = cls.__new__(cls)
+        extra = None
+        if not cls.SLOTS.keys() >= obj.keys():
+            extra = {key: value for key, value in obj.items() if key not in cls.SLOTS}
+        value = obj.get("type")
+        template.type = sys.intern(value) if type(value) is str else None
+        value = obj.get("style")
+        template.style = sys.intern(value) if type(value) is str else None
+        value = obj.get("content")
+        template.content = value if type(value) is str else None
+        value = obj.get("content_ref")
+        template.content_ref = sys.intern(value) if type(value) is str else None
+        value = obj.get("data")
+        if type(value) is dict:
+            keys = tuple(value)
+            template.data_keys = _DATA_KEYS.setdefault(keys, keys)
+            template.data_values = tuple(value.values())
+        else:
+            template.data_keys = template.data_values = None
+        value = obj.get("created_at")
+        template.created_at = pack_created_at(value) if type(value) is str else None
+        template.extra = extra
+        packed = ((template.type is not None) + (template.style is not None) + (template.content is not None)
+                  + (template.content_ref is not None) + (template.data_keys is not None)
+                  + (template.created_at is not None))
+        if packed + (len(extra) if extra else 0) != len(obj):
+            template._keep_unpacked(obj)
+        return template
+
+    def to_json(self):
+        obj = {}
+        if self.type is not None:
+            obj["type"] = self.type
+        if self.style is not None:
+            obj["style"] = self.style
+        if self.content is not None:
+            obj["content"] = self.content
+        if self.content_ref is not None:
+            obj["content_ref"] = self.content_ref
+        if self.data_keys is not None:
+            obj["data"] = dict(zip(self.data_keys, self.data_values))
+        if self.created_at is not None:
+            obj["created_at"] = unpack_created_at(self.created_at)
+        if self.extra:
+            obj.update(self.extra)
+        return obj
+
+    @property
+    def data(self):
+        return dict(zip(self.data_keys, self.data_values)) if self.data_keys is not None else None
+
+    def __reduce__(self):
+        return restore_template, (self.type, self.style, self.content, self.content_ref, self.data_keys,
+                                  self.data_values, self.created_at, self.extra)
+
+
+class User(Record):
+    __slots__ = ("password_hash", "email", "full_name", "templates", "created_at", "extra")
+    SLOTS = {"password": "password_hash", "email": "email", "full_name": "full_name", "templates": "templates",
+             "created_at": "created_at"}
+
+    @classmethod
+    def from_json(cls, obj):
+        user = cls.__new__(cls)
+        extra = None
+        if not cls.SLOTS.keys() >= obj.keys():
+            extra = {key: value for key, value in obj.items() if key not in cls.SLOTS}
+        value = obj.get("password")
+        user.password_hash = None
+        if type(value) is str and len(value) == 64:
+            try:
+                packed = bytes.fromhex(value)
+            except ValueError:
+                packed = None
+            if packed is not None and packed.hex() == value:
+                user.password_hash = packed
+        value = obj.get("email")
+        user.email = value if type(value) is str else None
+        value = obj.get("full_name")
+        user.full_name = value if type(value) is str else None
+        value = obj.get("templates")
+        if type(value) is dict:
+            from_json = SavedTemplate.from_json
+            user.templates = {name: from_json(template) for name, template in value.items()}
+        else:
+            user.templates = None
+        value = obj.get("created_at")
+        user.created_at = pack_created_at(value) if type(value) is str else None
+        user.extra = extra
+        packed = ((user.password_hash is not None) + (user.email is not None) + (user.full_name is not None)
+                  + (user.templates is not None) + (user.created_at is not None))
+        if packed + (len(extra) if extra else 0) != len(obj):
+            user._keep_unpacked(obj)
+        return user
+
+    def to_json(self):
+        obj = {}
+        if self.password_hash is not None:
+            obj["password"] = self.password_hash.hex()
+        if self.email is not None:
+            obj["email"] = self.email
+        if self.full_name is not None:
+            obj["full_name"] = self.full_name
+        if self.templates is not None:
+            obj["templates"] = {name: template.to_json() for name, template in self.templates.items()}
+        if self.created_at is not None:
+            obj["created_at"] = unpack_created_at(self.created_at)
+        if self.extra:
+            obj.update(self.extra)
+        return obj
+
+    @property
+    def password(self):
+        return self.password_hash.hex() if self.password_hash is not None else (self.extra or {}).get("password")
+
+    def __reduce__(self):
+        return restore_user, (self.password_hash, self.email, self.full_name, self.templates, self.created_at,
+                              self.extra)
+
+
+def restore_template(type_, style, content, content_ref, data_keys, data_values, created_at, extra):
+    """SavedTemplate from the slot values SavedTemplate.__reduce__ pickles"""
+    template = SavedTemplate.__new__(SavedTemplate)
+    template.type = type_
+    template.style = style
+    template.content = content
+    template.content_ref = content_ref
+    template.data_keys = _DATA_KEYS.setdefault(data_keys, data_keys) if data_keys is not None else None
+    template.data_values = data_values
+    template.created_at = created_at
+    template.extra = extra
+    return template
+
+
+def restore_user(password_hash, email, full_name, templates, created_at, extra):
+    """User from the slot values User.__reduce__ pickles"""
+    user = User.__new__(User)
+    user.password_hash = password_hash
+    user.email = email
+    user.full_name = full_name
+    user.templates = templates
+    user.created_at = created_at
+    user.extra = extra
+    return user
+
+
+@contextmanager
+def gc_paused():
+    """Suspend cyclic garbage collection while building a large structure that is kept whole"""
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def users_from_json(users):
+    """{username: User} from the users.json shape"""
+    from_json = User.from_json
+    with gc_paused():
+        return {username: from_json(user) for username, user in users.items()}
+
+
+def users_to_json(users):
+    """The users.json shape of {username: User}"""
+    with gc_paused():
+        return {username: user.to_json() for username, user in users.items()}